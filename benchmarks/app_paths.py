@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+In-process benchmark of the hot API paths.
+
+Boots ngl.main:app inside this process (lifespan included) and drives it
+through httpx's ASGI transport, so the numbers cover routing, validation,
+auth, the ORM and PostgreSQL, but not sockets or a TLS terminator. Firebase
+is stubbed: no credentials are loaded and every multicast "succeeds" after
+--fcm-latency-ms. There is no in-memory database backend, so it needs a
+PostgreSQL reachable through the usual DATABASE_* variables; DATABASE_SSL
+defaults to False here for a local server.
+
+Scenarios: add_message, inbox, mark_read, login, refresh. For each one it
+reports throughput, latency percentiles and SQL statements per request
+(counted on the engine, including background work such as the outbox
+dispatcher that the requests caused). Benchmark users are created with a
+unique prefix and deleted again afterwards.
+
+    python -m benchmarks.app_paths run --out before.json
+    python -m benchmarks.app_paths run --out after.json
+    python -m benchmarks.app_paths compare before.json after.json --threshold 0.1
+
+compare exits 1 if any scenario lost more than --threshold of its throughput,
+got that much slower at p50/p99, or issues more SQL per request.
+"""
+import os
+
+# Must be in place before ngl is imported (oAuthentication checks keys at import).
+os.environ.setdefault("DATABASE_SSL", "False")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("REFRESH_TOKEN_SECRET_KEY", "benchmark-refresh-secret")
+# Every request comes from one client address; the per-IP limiter would measure itself.
+os.environ.setdefault("RATE_LIMIT_ENABLED", "False")
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+PASSWORD = "benchmark-password"
+POLL_MARKER = "/* benchmark poll */"  # the harness's own queries, not counted
+SCENARIOS = ("add_message", "inbox", "mark_read", "login", "refresh")
+
+
+def stub_firebase(latency_ms: float):
+    """Replace Firebase app init and multicast sends with local fakes."""
+    import firebase_admin
+    from firebase_admin import credentials, messaging
+
+    credentials.Certificate = lambda *args, **kwargs: None
+    firebase_admin.initialize_app = lambda *args, **kwargs: None
+
+    async def send_each_for_multicast_async(multicast, dry_run=False, app=None):
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000.0)
+        return messaging.BatchResponse([messaging.SendResponse({"name": "bench"}, None) for _ in multicast.tokens])
+
+    messaging.send_each_for_multicast_async = send_each_for_multicast_async
+
+
+class SQLCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        self.enabled = True
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, *args):
+        if self.enabled and POLL_MARKER not in statement:
+            self.count += 1
+
+
+async def seed(prefix: str, users: int, messages_per_user: int) -> list[dict]:
+    from sqlalchemy import insert, select
+    from ngl.database import AsyncSessionLocal, User, Message
+    from ngl.hashing import Hash
+
+    hashed = Hash.bcrypt(PASSWORD)
+    ids = [f"{prefix}{i}" for i in range(users)]
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(User), [
+            {"id": uid, "name": uid, "password": hashed, "fcm_tokens": [f"{uid}-token"],
+             "message_count": messages_per_user, "unread_count": messages_per_user}
+            for uid in ids
+        ])
+        if messages_per_user:
+            await db.execute(insert(Message), [
+                {"user_id": uid, "content": f"seed message {n}", "unread": True}
+                for uid in ids for n in range(messages_per_user)
+            ])
+        await db.commit()
+        rows = (await db.execute(select(Message.user_id, Message.id).where(Message.user_id.in_(ids)))).all()
+    message_ids: dict[str, list[int]] = {uid: [] for uid in ids}
+    for uid, mid in rows:
+        message_ids[uid].append(mid)
+    return [{"id": uid, "message_ids": message_ids[uid]} for uid in ids]
+
+
+async def cleanup(prefix: str):
+    from sqlalchemy import delete
+    from ngl.database import AsyncSessionLocal, User, Message, NotificationOutbox
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(NotificationOutbox).where(NotificationOutbox.user_id.startswith(prefix)))
+        await db.execute(delete(Message).where(Message.user_id.startswith(prefix)))
+        await db.execute(delete(User).where(User.id.startswith(prefix)))
+        await db.commit()
+
+
+async def wait_for_outbox(prefix: str, timeout: float = 30.0):
+    """Let the dispatcher finish the notifications this scenario queued."""
+    from sqlalchemy import select, func
+    from ngl.database import AsyncSessionLocal, NotificationOutbox
+
+    deadline = time.monotonic() + timeout
+    async with AsyncSessionLocal() as db:
+        while time.monotonic() < deadline:
+            pending = await db.scalar(
+                select(func.count()).prefix_with(POLL_MARKER).select_from(NotificationOutbox).where(NotificationOutbox.user_id.startswith(prefix))
+            )
+            await db.rollback()
+            if not pending:
+                return
+            await asyncio.sleep(0.05)
+
+
+def make_request(name: str, users: list[dict], tokens: dict[str, dict]):
+    """Return (request(client, i) coroutine factory, expected status)."""
+    def user(i):
+        return users[i % len(users)]
+
+    def auth(uid):
+        return {"Authorization": f"Bearer {tokens[uid]['access_token']}"}
+
+    if name == "add_message":
+        return (lambda c, i: c.post(f"/sending/{user(i)['id']}", params={"message": f"benchmark message {i}"})), 202
+    if name == "inbox":
+        return (lambda c, i: c.get("/recieving/inbox", headers=auth(user(i)["id"]))), 200
+    if name == "mark_read":
+        def mark_read(c, i):
+            u = user(i)
+            ids = u["message_ids"]
+            return c.patch(f"/recieving/mark_read/{ids[(i // len(users)) % len(ids)]}", headers=auth(u["id"]))
+        return mark_read, 202
+    if name == "login":
+        return (lambda c, i: c.patch("/authentication/login", json={"user_id": user(i)["id"], "password": PASSWORD})), 202
+    if name == "refresh":
+        return (lambda c, i: c.post("/authentication/refresh", json={"refresh_token": tokens[user(i)["id"]]["refresh_token"]})), 200
+    raise ValueError(f"unknown scenario {name!r}")
+
+
+async def drive(client, request, expected: int, n: int, concurrency: int, offset: int = 0):
+    latencies: list[float] = []
+    errors = 0
+    next_i = 0
+
+    async def worker():
+        nonlocal next_i, errors
+        while next_i < n:
+            i = next_i
+            next_i += 1
+            started = time.perf_counter()
+            response = await request(client, offset + i)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != expected:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float, statements: int) -> dict:
+    ms = sorted(l * 1000.0 for l in latencies)
+    cuts = statistics.quantiles(ms, n=100, method="inclusive") if len(ms) > 1 else ms * 99
+    return {
+        "requests": len(ms),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ms) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "mean": round(statistics.fmean(ms), 3),
+            "p50": round(cuts[49], 3),
+            "p90": round(cuts[89], 3),
+            "p99": round(cuts[98], 3),
+            "max": round(ms[-1], 3),
+        },
+        "sql_per_request": round(statements / len(ms), 2),
+    }
+
+
+async def run(args) -> dict:
+    stub_firebase(args.fcm_latency_ms)
+    from ngl.main import app
+    from ngl.database import engine
+
+    counter = SQLCounter(engine)
+    counter.enabled = False
+    prefix = f"bench{os.getpid()}x"
+    results = {}
+    quiet = open(os.devnull, "w") if not args.verbose else None
+    if quiet:
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    async with app.router.lifespan_context(app):
+        users = await seed(prefix, args.users, args.seed_messages)
+        transport = httpx.ASGITransport(app=app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                tokens = {}
+                for u in users:
+                    r = await client.patch("/authentication/login", json={"user_id": u["id"], "password": PASSWORD})
+                    r.raise_for_status()
+                    tokens[u["id"]] = r.json()
+
+                for name in args.scenarios:
+                    request, expected = make_request(name, users, tokens)
+                    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+                        await drive(client, request, expected, args.warmup, args.concurrency)
+                        if name == "add_message":
+                            await wait_for_outbox(prefix)
+                        counter.count = 0
+                        counter.enabled = True
+                        latencies, errors, elapsed = await drive(
+                            client, request, expected, args.requests, args.concurrency, offset=args.warmup
+                        )
+                        if name == "add_message":
+                            await wait_for_outbox(prefix)
+                        counter.enabled = False
+                    results[name] = summarize(latencies, errors, elapsed, counter.count)
+                    r = results[name]
+                    print(f"{name:<12} {r['throughput_rps']:>9} req/s  p50={r['latency_ms']['p50']}ms "
+                          f"p99={r['latency_ms']['p99']}ms  sql/req={r['sql_per_request']}  errors={r['errors']}")
+        finally:
+            await cleanup(prefix)
+    if quiet:
+        quiet.close()
+    await engine.dispose()
+    return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> list[str]:
+    failures = []
+    print(f"{'scenario':<12} {'metric':<15} {'baseline':>10} {'candidate':>10} {'change':>8}")
+    for name, base in baseline["scenarios"].items():
+        cand = candidate["scenarios"].get(name)
+        if cand is None:
+            continue
+        checks = [
+            ("throughput_rps", base["throughput_rps"], cand["throughput_rps"], True),
+            ("p50_ms", base["latency_ms"]["p50"], cand["latency_ms"]["p50"], False),
+            ("p99_ms", base["latency_ms"]["p99"], cand["latency_ms"]["p99"], False),
+            ("sql_per_request", base["sql_per_request"], cand["sql_per_request"], False),
+        ]
+        for metric, b, c, higher_is_better in checks:
+            change = (c - b) / b if b else 0.0
+            if metric == "sql_per_request":
+                # Statement counts are deterministic: any real increase is a regression.
+                failed = c > b + 0.05
+            else:
+                failed = (-change if higher_is_better else change) > threshold
+            if failed:
+                failures.append(f"{name} {metric}: {b} -> {c}")
+            print(f"{name:<12} {metric:<15} {b:>10} {c:>10} {change:>+7.1%}{'  FAIL' if failed else ''}")
+        if cand["errors"] > base["errors"]:
+            failures.append(f"{name} errors: {base['errors']} -> {cand['errors']}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="run the scenarios and write a JSON result file")
+    p_run.add_argument("--out", help="write results to this JSON file")
+    p_run.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ", ".join(SCENARIOS))
+    p_run.add_argument("--requests", type=int, default=500, help="measured requests per scenario")
+    p_run.add_argument("--warmup", type=int, default=50)
+    p_run.add_argument("--concurrency", type=int, default=16)
+    p_run.add_argument("--users", type=int, default=20)
+    p_run.add_argument("--seed-messages", type=int, default=100, help="messages per user before the run")
+    p_run.add_argument("--fcm-latency-ms", type=float, default=0.0, help="simulated FCM round trip")
+    p_run.add_argument("--verbose", action="store_true", help="keep the app's stdout output")
+
+    p_cmp = sub.add_parser("compare", help="compare two result files")
+    p_cmp.add_argument("baseline")
+    p_cmp.add_argument("candidate")
+    p_cmp.add_argument("--threshold", type=float, default=0.10, help="allowed relative regression (0.10 = 10%%)")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+        unknown = set(args.scenarios) - set(SCENARIOS)
+        if unknown:
+            parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+        scenarios = asyncio.run(run(args))
+        params = {k: v for k, v in vars(args).items() if k not in ("command", "out", "verbose")}
+        result = {
+            "meta": {
+                "at": datetime.now(timezone.utc).isoformat(),
+                "git": git_revision(),
+                "python": platform.python_version(),
+                "params": params,
+            },
+            "scenarios": scenarios,
+        }
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(result, f, indent=2)
+            print(f"wrote {args.out}")
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.candidate) as f:
+            candidate = json.load(f)
+        failures = compare(baseline, candidate, args.threshold)
+        if failures:
+            print("\nREGRESSIONS:\n  " + "\n  ".join(failures))
+            sys.exit(1)
+        print("\nno regressions")
+
+
+if __name__ == "__main__":
+    main()
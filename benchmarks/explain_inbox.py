@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Before/after EXPLAIN ANALYZE for the inbox queries.
+
+Builds two scratch schemas in the configured database (see ngl/database.py):
+
+  bench_inbox_before  legacy layout: time VARCHAR, single-column user_id index
+  bench_inbox_after   current layout: time timestamptz, (user_id, id DESC)
+                      and partial unread indexes
+
+seeds both with the same synthetic data, runs each query several times and
+reports the median execution time and buffers touched. The schemas are
+dropped afterwards unless --keep is given.
+
+    python -m benchmarks.explain_inbox [--messages 1000000] [--heavy-share 0.1]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+
+from sqlalchemy import text
+
+from ngl.database import engine
+
+LAYOUTS = {
+    "before": [
+        "CREATE TABLE users (id VARCHAR PRIMARY KEY)",
+        "CREATE TABLE messages ("
+        "  id SERIAL PRIMARY KEY, user_id VARCHAR NOT NULL REFERENCES users(id),"
+        "  content VARCHAR NOT NULL, time VARCHAR NOT NULL, unread BOOLEAN)",
+        "CREATE INDEX ix_messages_id ON messages (id)",
+        "CREATE INDEX ix_messages_user_id ON messages (user_id)",
+    ],
+    "after": [
+        "CREATE TABLE users (id VARCHAR PRIMARY KEY)",
+        "CREATE TABLE messages ("
+        "  id SERIAL PRIMARY KEY, user_id VARCHAR NOT NULL REFERENCES users(id),"
+        "  content VARCHAR NOT NULL, time timestamptz NOT NULL DEFAULT now(), unread BOOLEAN)",
+        "CREATE INDEX ix_messages_id ON messages (id)",
+        "CREATE INDEX ix_messages_user_id_id_desc ON messages (user_id, id DESC)",
+        "CREATE INDEX ix_messages_user_id_unread ON messages (user_id) WHERE unread = true",
+    ],
+}
+
+QUERIES = {
+    "inbox_first_page": (
+        "SELECT id, user_id, content, time, unread FROM messages "
+        "WHERE user_id = 'heavy' ORDER BY id DESC LIMIT 100"
+    ),
+    "inbox_keyset_page": (
+        "SELECT id, user_id, content, time, unread FROM messages "
+        "WHERE user_id = 'heavy' AND id < :mid ORDER BY id DESC LIMIT 100"
+    ),
+    "count_all": "SELECT count(id) FROM messages WHERE user_id = 'heavy'",
+    "count_unread": "SELECT count(id) FROM messages WHERE user_id = 'heavy' AND unread = true",
+}
+
+
+async def build(conn, layout: str, messages: int, users: int, heavy_share: float):
+    schema = f"bench_inbox_{layout}"
+    await conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+    await conn.execute(text(f"CREATE SCHEMA {schema}"))
+    await conn.execute(text(f"SET search_path TO {schema}"))
+    for ddl in LAYOUTS[layout]:
+        await conn.execute(text(ddl))
+
+    await conn.execute(text(
+        "INSERT INTO users SELECT 'u' || g FROM generate_series(0, :users - 1) g UNION ALL SELECT 'heavy'"
+    ), {"users": users})
+    time_expr = "to_char(ts, 'YYYY-MM-DD\"T\"HH24:MI:SS.US')" if layout == "before" else "ts"
+    # Same rows for both layouts: ~heavy_share of messages go to one heavy user, ~1 in 7 stay unread.
+    await conn.execute(text(
+        "INSERT INTO messages (user_id, content, time, unread) "
+        f"SELECT CASE WHEN (g::bigint * 7919) % 1000 < :heavy THEN 'heavy' ELSE 'u' || (g % :users) END, "
+        f"       repeat('x', 80), {time_expr}, g % 7 = 0 "
+        "FROM generate_series(1, :n) g, LATERAL (SELECT now() - (:n - g) * interval '1 second' AS ts) t"
+    ), {"n": messages, "users": users, "heavy": int(heavy_share * 1000)})
+    await conn.execute(text("VACUUM ANALYZE messages"))
+    await conn.execute(text("VACUUM ANALYZE users"))
+
+
+async def explain(conn, layout: str, sql: str, params: dict, runs: int) -> dict:
+    await conn.execute(text(f"SET search_path TO bench_inbox_{layout}"))
+    samples = []
+    for _ in range(runs):
+        plan = (await conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}"), params)).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        samples.append(plan[0])
+    top = samples[-1]["Plan"]
+    node = top
+    while node.get("Plans") and node["Node Type"] in ("Limit", "Aggregate"):
+        node = node["Plans"][0]
+    return {
+        "execution_ms": round(statistics.median(s["Execution Time"] for s in samples), 3),
+        "planning_ms": round(statistics.median(s["Planning Time"] for s in samples), 3),
+        "buffers": top.get("Shared Hit Blocks", 0) + top.get("Shared Read Blocks", 0),
+        "access": f'{node["Node Type"]} {node.get("Index Name", "")}'.strip(),
+    }
+
+
+async def main(args):
+    results = {}
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        for layout in LAYOUTS:
+            print(f"seeding {layout} ({args.messages} messages) ...")
+            await build(conn, layout, args.messages, args.users, args.heavy_share)
+
+        mid = await conn.scalar(text(
+            "SELECT id FROM bench_inbox_after.messages WHERE user_id = 'heavy' ORDER BY id LIMIT 1 "
+            "OFFSET (SELECT count(*) / 2 FROM bench_inbox_after.messages WHERE user_id = 'heavy')"
+        ))
+        for name, sql in QUERIES.items():
+            params = {"mid": mid} if ":mid" in sql else {}
+            results[name] = {layout: await explain(conn, layout, sql, params, args.runs) for layout in LAYOUTS}
+
+        if not args.keep:
+            for layout in LAYOUTS:
+                await conn.execute(text(f"DROP SCHEMA bench_inbox_{layout} CASCADE"))
+    await engine.dispose()
+
+    print(f"\n{'query':<20} {'layout':<7} {'exec ms':>9} {'plan ms':>8} {'buffers':>8}  access path")
+    for name, by_layout in results.items():
+        for layout, r in by_layout.items():
+            print(f"{name:<20} {layout:<7} {r['execution_ms']:>9} {r['planning_ms']:>8} {r['buffers']:>8}  {r['access']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"params": vars(args), "results": results}, f, indent=2)
+        print(f"\nwrote {args.json}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--heavy-share", type=float, default=0.1, help="fraction of messages sent to the heavy user")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", help="also write results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch schemas")
+    asyncio.run(main(parser.parse_args()))
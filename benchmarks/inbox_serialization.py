@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: building an inbox page from ORM entities through
+schema.Inbox / InboxSummary (INBOX_FAST_PATH=False), against Core row
+tuples rendered to JSON by receiving.render_inbox (the default).
+
+For each page size and mode (full, summary) it measures
+
+  serialize  CPU only, rows already fetched: model construction with
+             from_attributes plus FastAPI's response_model pass
+             (serialize_response, as the route runs it), against
+             render_inbox on the tuples
+  endpoint   GET /recieving/inbox in-process through the ASGI app with each
+             INBOX_FAST_PATH setting, which adds the query, ORM hydration,
+             auth and routing
+
+Both paths must return identical response bodies; the run stops if they
+don't. Needs PostgreSQL like benchmarks.app_paths; the seeded user is
+removed afterwards.
+
+    python -m benchmarks.inbox_serialization [--page-sizes 20,100] [--iterations 300] [--out inbox.json]
+"""
+import os
+
+os.environ.setdefault("DATABASE_SSL", "False")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("REFRESH_TOKEN_SECRET_KEY", "benchmark-refresh-secret")
+
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+
+import httpx
+
+from .app_paths import PASSWORD, cleanup, seed, stub_firebase
+
+MODES = ("full", "summary")
+
+
+def summarize(samples_ms: list[float]) -> dict:
+    samples_ms = sorted(samples_ms)
+    return {
+        "mean_ms": round(statistics.fmean(samples_ms), 4),
+        "p50_ms": round(samples_ms[len(samples_ms) // 2], 4),
+        "p95_ms": round(samples_ms[int(len(samples_ms) * 0.95) - 1], 4),
+    }
+
+
+def compare(orm: dict, fast: dict) -> dict:
+    return {"orm": orm, "fast": fast, "speedup_p50": round(orm["p50_ms"] / fast["p50_ms"], 2)}
+
+
+async def bench_serialize(user_id: str, limit: int, summary: bool, iterations: int) -> dict:
+    from fastapi.routing import serialize_response
+    from sqlalchemy import select, desc
+    from ngl import schema
+    from ngl.database import AsyncSessionLocal, Message
+    from ngl.router import receiving
+
+    route = next(r for r in receiving.router.routes if r.path == "/recieving/inbox")
+    async with AsyncSessionLocal() as db:
+        counts = await receiving.inbox_counters(db, user_id)
+        page = lambda *columns: select(*columns).where(Message.user_id == user_id).order_by(desc(Message.id)).limit(limit)
+        result = await db.execute(page(Message.id, Message.time, Message.unread) if summary else page(Message))
+        entities = result.all() if summary else result.scalars().all()
+        rows = (await db.execute(page(*receiving.inbox_columns(summary)))).all()
+    model = schema.InboxSummary if summary else schema.Inbox
+
+    async def orm_path() -> bytes:
+        content = model(message_count=counts.message_count, unread_count=counts.unread_count, messages=entities, next_cursor=None)
+        return await serialize_response(field=route.response_field, response_content=content, dump_json=True)
+
+    async def fast_path() -> bytes:
+        return receiving.render_inbox(counts, rows, summary, None)
+
+    if await orm_path() != await fast_path():
+        raise SystemExit(f"serialize: bodies differ (limit={limit}, summary={summary})")
+
+    timings = {}
+    for name, fn in (("orm", orm_path), ("fast", fast_path)):
+        for _ in range(min(50, iterations)):
+            await fn()
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            await fn()
+            samples.append((time.perf_counter() - started) * 1000)
+        timings[name] = summarize(samples)
+    return compare(timings["orm"], timings["fast"])
+
+
+async def bench_endpoint(client: httpx.AsyncClient, headers: dict, limit: int, summary: bool, iterations: int) -> dict:
+    from ngl.router import receiving
+
+    url = f"/recieving/inbox?limit={limit}&summary={str(summary).lower()}"
+    bodies, timings = {}, {}
+    for name, fast in (("orm", False), ("fast", True)):
+        receiving.INBOX_FAST_PATH = fast
+        for _ in range(min(20, iterations)):
+            bodies[name] = (await client.get(url, headers=headers)).content
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            response = await client.get(url, headers=headers)
+            samples.append((time.perf_counter() - started) * 1000)
+            response.raise_for_status()
+        timings[name] = summarize(samples)
+    receiving.INBOX_FAST_PATH = True
+    if bodies["orm"] != bodies["fast"]:
+        raise SystemExit(f"endpoint: bodies differ (limit={limit}, summary={summary})")
+    return compare(timings["orm"], timings["fast"])
+
+
+async def run(args) -> dict:
+    stub_firebase(0)
+    from ngl.main import app
+    from ngl.router import receiving
+
+    prefix = f"bench-inbox-{os.getpid()}-"
+    report = {"orjson": receiving.orjson is not None, "iterations": args.iterations, "results": []}
+    async with app.router.lifespan_context(app):
+        await cleanup(prefix)
+        [user] = await seed(prefix, 1, max(args.page_sizes))
+        try:
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                login = await client.patch("/authentication/login", json={"user_id": user["id"], "password": PASSWORD})
+                headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+                for limit in args.page_sizes:
+                    for mode in MODES:
+                        summary = mode == "summary"
+                        entry = {
+                            "limit": limit,
+                            "mode": mode,
+                            "serialize": await bench_serialize(user["id"], limit, summary, args.iterations),
+                            "endpoint": await bench_endpoint(client, headers, limit, summary, args.iterations),
+                        }
+                        report["results"].append(entry)
+                        print(
+                            f"limit={limit:<4} {mode:<8} serialize x{entry['serialize']['speedup_p50']:<6} "
+                            f"endpoint x{entry['endpoint']['speedup_p50']}",
+                            flush=True,
+                        )
+        finally:
+            await cleanup(prefix)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--page-sizes", default="20,100", type=lambda s: [int(n) for n in s.split(",")])
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--out", help="write the JSON report here as well as to stdout")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's INFO logging")
+    args = parser.parse_args()
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
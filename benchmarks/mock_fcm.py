@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the FCM v1 HTTP API, for load tests that must not reach Google.
+
+Answers POST /v1/projects/{project}/messages:send the way FCM does: a
+message name on success, and FCM-shaped error bodies otherwise, so the
+firebase_admin client maps them to the same exceptions (UnregisteredError
+prunes the token, UNAVAILABLE/INTERNAL are retried by the outbox).
+Point the app at it with
+
+    FCM_ENDPOINT=http://127.0.0.1:9099 uvicorn ngl.main:app
+
+and run
+
+    python -m benchmarks.mock_fcm --port 9099 --latency-ms 40 --jitter-ms 20 \\
+        --failure-rate 0.02 --unregistered-rate 0.005
+
+GET /stats returns request/outcome counts; POST /config changes latency and
+rates while a test is running (same field names as the flags, underscored).
+"""
+import argparse
+import asyncio
+import random
+import time
+from itertools import count
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+
+config = {
+    "latency_ms": 0.0,
+    "jitter_ms": 0.0,
+    "failure_rate": 0.0,       # UNAVAILABLE (503), retryable
+    "unregistered_rate": 0.0,  # UNREGISTERED (404), token is dead
+}
+_stats = {"requests": 0, "ok": 0, "unavailable": 0, "unregistered": 0, "tokens": 0}
+_tokens: set[str] = set()
+_ids = count(1)
+_started = time.time()
+
+
+def _error(code: int, status: str, message: str, fcm_code: str | None = None) -> JSONResponse:
+    error = {"code": code, "status": status, "message": message}
+    if fcm_code:
+        error["details"] = [{"@type": "type.googleapis.com/google.firebase.fcm.v1.FcmError", "errorCode": fcm_code}]
+    return JSONResponse({"error": error}, status_code=code)
+
+
+@app.post("/v1/projects/{project}/messages:send")
+async def send(project: str, request: Request):
+    body = await request.json()
+    token = body.get("message", {}).get("token")
+    _stats["requests"] += 1
+    if token:
+        _tokens.add(token)
+        _stats["tokens"] = len(_tokens)
+
+    delay = config["latency_ms"] + random.uniform(-1.0, 1.0) * config["jitter_ms"]
+    if delay > 0:
+        await asyncio.sleep(delay / 1000.0)
+
+    roll = random.random()
+    if roll < config["unregistered_rate"]:
+        _stats["unregistered"] += 1
+        return _error(404, "NOT_FOUND", "Requested entity was not found.", "UNREGISTERED")
+    if roll < config["unregistered_rate"] + config["failure_rate"]:
+        _stats["unavailable"] += 1
+        return _error(503, "UNAVAILABLE", "The service is currently unavailable.", "UNAVAILABLE")
+    _stats["ok"] += 1
+    return {"name": f"projects/{project}/messages/{next(_ids)}"}
+
+
+@app.get("/stats")
+async def stats():
+    elapsed = time.time() - _started
+    return {**_stats, "uptime_s": round(elapsed, 1), "rps": round(_stats["requests"] / elapsed, 1), "config": config}
+
+
+@app.post("/config")
+async def set_config(changes: dict):
+    for key, value in changes.items():
+        if key in config:
+            config[key] = float(value)
+    return config
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9099)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="latency is uniform in latency +/- jitter")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction answered 503 UNAVAILABLE")
+    parser.add_argument("--unregistered-rate", type=float, default=0.0, help="fraction answered 404 UNREGISTERED")
+    args = parser.parse_args()
+    for key in config:
+        config[key] = getattr(args, key)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
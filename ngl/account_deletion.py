@@ -0,0 +1,182 @@
+# account_deletion.py
+"""
+Account deletion, carried out in the background.
+
+delete_account only calls request(): in the request's own transaction the
+user is marked deleted (user_cache then reads them as gone, so sends, token
+refreshes and the profile page refuse them at once, on other workers within
+USER_CACHE_TTL_SECONDS), their FCM tokens are dropped and an
+account_deletions row is queued. The dispatcher then
+
+  1. deletes their messages ACCOUNT_DELETION_CHUNK_SIZE at a time, one short
+     transaction per chunk, adding each chunk to messages_deleted;
+  2. waits until USER_CACHE_TTL_SECONDS after the request, so no worker can
+     still accept a message for the account from a stale cache entry;
+  3. in a last transaction deletes any stragglers, pending notifications,
+     the Google link and the user row, and sets completed_at.
+
+The queue row is claimed per chunk with SKIP LOCKED and never held between
+chunks, so deletions survive restarts and any worker process can carry on
+any of them. GET /authentication/delete_account/status reads progress.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import AsyncSessionLocal, AccountDeletion, GoogleUsers, Message, NotificationOutbox, User
+from . import metrics, user_cache
+
+logger = logging.getLogger("account_deletion")
+
+CHUNK_SIZE = int(os.getenv("ACCOUNT_DELETION_CHUNK_SIZE", "1000"))
+CHUNK_PAUSE_MS = float(os.getenv("ACCOUNT_DELETION_PAUSE_MS", "50"))
+IDLE_SECONDS = float(os.getenv("ACCOUNT_DELETION_IDLE_SECONDS", "30"))
+# Time for every worker's user_cache entry for the account to expire
+CACHE_GRACE = timedelta(seconds=user_cache.USER_CACHE_TTL_SECONDS + 1)
+
+_wakeup: asyncio.Event | None = None
+_task: asyncio.Task | None = None
+_completed = 0
+_chunks = 0
+_messages_deleted = 0
+_failures = 0
+_last_chunk_ms: float | None = None
+
+
+async def request(db: AsyncSession, user: User):
+    """Mark user deleted and queue the cleanup, in the caller's transaction. Commit, then wake()."""
+    user.deleted_at = func.now()
+    user.fcm_tokens = None
+    queued = {"messages_total": user.message_count, "messages_deleted": 0, "completed_at": None}
+    await db.execute(
+        pg_insert(AccountDeletion)
+        .values(user_id=user.id, **queued)
+        # An id can be re-registered after a completed deletion and deleted again
+        .on_conflict_do_update(
+            index_elements=[AccountDeletion.user_id],
+            set_={**queued, "requested_at": func.now(), "next_attempt_at": func.now()},
+        )
+    )
+
+
+def wake():
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def progress(db: AsyncSession, user_id: str) -> dict | None:
+    deletion = await db.get(AccountDeletion, user_id, populate_existing=True)
+    if deletion is None:
+        return None
+    return {
+        "user_id": deletion.user_id,
+        "state": "completed" if deletion.completed_at else "deleting",
+        "requested_at": deletion.requested_at,
+        "messages_total": deletion.messages_total,
+        "messages_deleted": deletion.messages_deleted,
+        "completed_at": deletion.completed_at,
+    }
+
+
+async def _finish(db: AsyncSession, deletion: AccountDeletion):
+    user_id = deletion.user_id
+    await db.execute(delete(NotificationOutbox).where(NotificationOutbox.user_id == user_id))
+    await db.execute(delete(GoogleUsers).where(GoogleUsers.user_id == user_id))
+    await db.execute(delete(User).where(User.id == user_id))
+    deletion.completed_at = func.now()
+
+
+async def _step() -> bool:
+    """Delete one chunk of the next due account; False when nothing is due."""
+    global _completed, _chunks, _messages_deleted, _last_chunk_ms
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        deletion = (await db.execute(
+            select(AccountDeletion)
+            .where(AccountDeletion.completed_at.is_(None), AccountDeletion.next_attempt_at <= func.now())
+            .order_by(AccountDeletion.next_attempt_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )).scalar_one_or_none()
+        if deletion is None:
+            return False
+
+        chunk = select(Message.id).where(Message.user_id == deletion.user_id).order_by(Message.id.desc()).limit(CHUNK_SIZE)
+        deleted = (await db.execute(delete(Message).where(Message.id.in_(chunk)))).rowcount
+        deletion.messages_deleted += deleted
+        finished = False
+        if deleted < CHUNK_SIZE:
+            ready_at = deletion.requested_at + CACHE_GRACE
+            if datetime.now(timezone.utc) < ready_at:
+                deletion.next_attempt_at = ready_at
+            else:
+                await _finish(db, deletion)
+                finished = True
+        await db.commit()
+
+    _last_chunk_ms = (time.perf_counter() - started) * 1000
+    metrics.observe_background_batch("account_deletion", _last_chunk_ms / 1000)
+    _chunks += 1
+    _messages_deleted += deleted
+    if finished:
+        _completed += 1
+        user_cache.invalidate(deletion.user_id)
+        logger.info(f"[deletion] {deletion.user_id} deleted ({deletion.messages_deleted} messages)")
+    return True
+
+
+async def _run():
+    global _failures
+    while True:
+        # Clear before looking so a wake() during the step isn't lost
+        _wakeup.clear()
+        try:
+            busy = await _step()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _failures += 1
+            logger.warning(f"[deletion] chunk failed: {e}")
+            busy = False
+
+        if busy:
+            await asyncio.sleep(CHUNK_PAUSE_MS / 1000.0)
+            continue
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=IDLE_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start():
+    global _wakeup, _task
+    if _task is not None:
+        return
+    _wakeup = asyncio.Event()
+    _task = asyncio.get_running_loop().create_task(_run())
+
+
+async def stop():
+    """An interrupted chunk rolls back; the deletion resumes on the next start."""
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    await asyncio.gather(_task, return_exceptions=True)
+    _task = None
+
+
+def stats() -> dict:
+    return {
+        "completed": _completed,
+        "chunks": _chunks,
+        "messages_deleted": _messages_deleted,
+        "failures": _failures,
+        "last_chunk_ms": _last_chunk_ms,
+    }
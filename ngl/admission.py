@@ -0,0 +1,182 @@
+# admission.py
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException, Request, status
+
+from . import metrics
+
+# Priorities, lower is served first
+HIGH, NORMAL, LOW = 0, 1, 2
+PRIORITY_NAMES = {HIGH: "high", NORMAL: "normal", LOW: "low"}
+
+# Route template prefix -> priority. Signed-in users reading their inbox and
+# logging in go ahead of anonymous senders, who are shed first.
+ROUTE_PRIORITIES = (
+    ("/recieving", HIGH),
+    ("/authentication", HIGH),
+    ("/sending", LOW),
+)
+
+ADMISSION_ENABLED = os.getenv("DB_ADMISSION_ENABLED", "True") == "True"
+# Pool connections kept out of reach of requests, so the outbox dispatcher
+# and insert batcher always find a free one.
+RESERVED_CONNECTIONS = int(os.getenv("DB_ADMISSION_RESERVED", "8"))
+QUEUE_LIMIT = int(os.getenv("DB_ADMISSION_QUEUE_LIMIT", "200"))
+LOW_QUEUE_LIMIT = int(os.getenv("DB_ADMISSION_LOW_QUEUE_LIMIT", "50"))
+MAX_WAIT_SECONDS = float(os.getenv("DB_ADMISSION_MAX_WAIT_MS", "2000")) / 1000.0
+RETRY_AFTER_SECONDS = os.getenv("DB_ADMISSION_RETRY_AFTER", "1")
+
+
+class Admission:
+    """
+    Counting semaphore with a bounded priority wait queue. A released slot
+    goes straight to the best waiter, so in_use never dips while there is a
+    queue. Waiters that time out or disconnect are skipped lazily on release.
+    """
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.in_use = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self._heap: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self.admitted = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.rejected = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.timed_out = 0
+
+    def _reject(self, priority: int):
+        self.rejected[PRIORITY_NAMES[priority]] += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, please retry",
+            headers={"Retry-After": RETRY_AFTER_SECONDS},
+        )
+
+    async def acquire(self, priority: int) -> float:
+        """Wait for a slot; returns seconds waited. Raises 503 when shedding."""
+        if self.in_use < self.limit and not self.waiting:
+            self.in_use += 1
+            self.admitted[PRIORITY_NAMES[priority]] += 1
+            return 0.0
+
+        queue_limit = LOW_QUEUE_LIMIT if priority >= LOW else QUEUE_LIMIT
+        if self.waiting >= queue_limit:
+            self._reject(priority)
+
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future))
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await asyncio.wait_for(future, MAX_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            self.waiting -= 1
+            self.timed_out += 1
+            self._reject(priority)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # handed a slot just as the client went away
+            else:
+                self.waiting -= 1
+            raise
+        self.admitted[PRIORITY_NAMES[priority]] += 1
+        return time.perf_counter() - started
+
+    def release(self):
+        while self._heap:
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                self.waiting -= 1
+                future.set_result(None)  # slot changes hands, in_use stays
+                return
+        self.in_use -= 1
+
+
+# One gate per connection pool: "primary", and "replica" when one is configured
+_gates: dict[str, Admission] = {}
+
+
+def configure(pool_size: int, gate: str = "primary", reserved: int = RESERVED_CONNECTIONS):
+    """Called by database.py once the engine exists."""
+    _gates[gate] = Admission(gate, max(1, pool_size - reserved))
+
+
+def route_priority(request: Request) -> int:
+    route = request.scope.get("route")
+    path = route.path if route else request.url.path
+    for prefix, priority in ROUTE_PRIORITIES:
+        if path.startswith(prefix):
+            return priority
+    return NORMAL
+
+
+@asynccontextmanager
+async def admit(request: Request | None, gate: str = "primary"):
+    """Hold a DB slot for the body; release_early(request) gives it back sooner."""
+    admission = _gates.get(gate)
+    if not ADMISSION_ENABLED or admission is None or request is None:
+        yield
+        return
+    priority = route_priority(request)
+    waited = await admission.acquire(priority)
+    metrics.observe_db_checkout_wait(gate, PRIORITY_NAMES[priority], waited)
+    slot = _Slot(admission)
+    request.state.db_slot = slot
+    try:
+        yield
+    finally:
+        slot.release()
+
+
+class _Slot:
+    __slots__ = ("admission", "held")
+
+    def __init__(self, admission: Admission):
+        self.admission = admission
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.admission.release()
+
+
+def release_early(request: Request):
+    """For handlers that close their session before a long non-DB wait."""
+    slot = getattr(request.state, "db_slot", None)
+    if slot is not None:
+        slot.release()
+
+
+async def readmit(request: Request):
+    """Queue for the slot again after release_early, before touching the DB."""
+    slot = getattr(request.state, "db_slot", None)
+    if slot is not None and not slot.held:
+        await slot.admission.acquire(route_priority(request))
+        slot.held = True
+
+
+def stats(gate: str = "primary") -> dict:
+    a = _gates.get(gate)
+    if a is None:
+        return {"enabled": ADMISSION_ENABLED}
+    return {
+        "enabled": ADMISSION_ENABLED,
+        "limit": a.limit,
+        "in_use": a.in_use,
+        "queue_depth": a.waiting,
+        "max_queue_depth": a.max_waiting,
+        "queue_limit": QUEUE_LIMIT,
+        "low_queue_limit": LOW_QUEUE_LIMIT,
+        "timed_out": a.timed_out,
+        **{f"admitted_{k}": v for k, v in a.admitted.items()},
+        **{f"rejected_{k}": v for k, v in a.rejected.items()},
+    }
@@ -0,0 +1,31 @@
+# counters.py
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import User
+
+
+async def bump(db: AsyncSession, user_id: str, messages: int = 0, unread: int = 0):
+    """
+    Adjust a user's inbox counters inside the caller's transaction, so they
+    commit (or roll back) together with the message change they describe.
+    Also bumps inbox_version, which invalidates the inbox ETag.
+    """
+    if not messages and not unread:
+        return
+    await db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(
+            message_count=User.message_count + messages,
+            unread_count=User.unread_count + unread,
+            inbox_version=User.inbox_version + 1,
+        )
+    )
+
+
+async def bump_many(db: AsyncSession, deltas: dict[str, tuple[int, int]]):
+    """bump() for several users; rows are locked in id order to avoid deadlocks between batches."""
+    for user_id in sorted(deltas):
+        messages, unread = deltas[user_id]
+        await bump(db, user_id, messages, unread)
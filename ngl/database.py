@@ -1,9 +1,16 @@
-from sqlalchemy import ForeignKey, Column, String, Integer, Boolean, BigInteger, select, ARRAY
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy import ForeignKey, Column, String, Integer, Boolean, BigInteger, select, ARRAY, JSON, DateTime, Index, func, desc, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.orm import declarative_base, relationship, Session
+from sqlalchemy.sql import Insert, Update, Delete
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 import os
 from dotenv import load_dotenv
+import math
+import time
 from urllib.parse import quote_plus
+from fastapi import Request, Response
+from . import admission
 
 # Load environment variables
 load_dotenv()
@@ -15,23 +22,60 @@ DATABASE_NAME = os.getenv("DATABASE_NAME")
 DATABASE_USER = os.getenv("DATABASE_USER")
 DATABASE_PASSWORD = os.getenv("DATABASE_PASSWORD")
 IS_INTERNAL = os.getenv("IS_INTERNAL", "False") == "True"
+# Set DATABASE_SSL=False for a local PostgreSQL without TLS (benchmarks, development)
+DATABASE_SSL = os.getenv("DATABASE_SSL", "True") == "True"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "80"))
+# Optional read replica; read-only routes fall back to the primary without it
+DATABASE_READ_HOST = os.getenv("DATABASE_READ_HOST")
+DATABASE_READ_PORT = os.getenv("DATABASE_READ_PORT", DATABASE_PORT)
+DATABASE_READ_USER = os.getenv("DATABASE_READ_USER", DATABASE_USER)
+DATABASE_READ_PASSWORD = os.getenv("DATABASE_READ_PASSWORD", DATABASE_PASSWORD)
+READ_DB_POOL_SIZE = int(os.getenv("READ_DB_POOL_SIZE", str(DB_POOL_SIZE)))
+# After a client changes its inbox, its reads go to the primary for this
+# long, so it never sees the replica's older copy. Keep it above replica lag.
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+# Bump when a table, index or column is added. Startup compares it with the
+# schema_version table (one query) instead of running create_all every boot.
+# New columns on existing tables also go in SCHEMA_UPGRADES; type changes
+# still need a migration script (migrate_messages.py), and ensure_schema()
+# refuses to record the version until it has run.
+SCHEMA_VERSION = 4
+SCHEMA_UPGRADES = (
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS message_count INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS unread_count INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS inbox_version BIGINT NOT NULL DEFAULT 0",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP WITH TIME ZONE",
+)
+# Fills the counters in once, when the upgrade above has just added them.
+# On a big database run `python -m ngl.reconcile_counters` before deploying
+# instead: it adds the columns and recounts in small batches.
+_RECOUNT_INBOX_COUNTERS = """
+    UPDATE users SET message_count = c.total, unread_count = c.unread
+    FROM (
+        SELECT user_id, count(*) AS total, count(*) FILTER (WHERE unread) AS unread
+        FROM messages GROUP BY user_id
+    ) c
+    WHERE users.id = c.user_id
+"""
 # URL encode the password to handle special characters
 encoded_password = quote_plus(DATABASE_PASSWORD)
 
 # For Render PostgreSQL, construct URL without SSL in string (SSL handled in connect_args)
 DATABASE_URL = f"postgresql+asyncpg://{DATABASE_USER}:{encoded_password}@{DATABASE_HOST}:{DATABASE_PORT}/{DATABASE_NAME}"
 
+# SSL configuration for Render PostgreSQL
+CONNECT_ARGS = {
+    "ssl": "require" if IS_INTERNAL else True
+} if DATABASE_SSL else {}
+
 # Engine configuration for remote PostgreSQL (like Render)
 engine = create_async_engine(
     DATABASE_URL, 
     # echo=True, ## Danger / revise
     echo = False,
-    # SSL configuration for Render PostgreSQL
-    connect_args={
-        "ssl": "require" if IS_INTERNAL else True
-    },
+    connect_args=CONNECT_ARGS,
     # Connection pool settings for remote database
-    pool_size=80,
+    pool_size=DB_POOL_SIZE,
     max_overflow=0,
     pool_pre_ping=True,  # Validate connections before use  ## Danger / revise
     pool_recycle=3600,   # Recycle connections every hour
@@ -44,6 +88,97 @@ AsyncSessionLocal = async_sessionmaker(
     autoflush=False,
 )
 
+if DATABASE_READ_HOST:
+    READ_DATABASE_URL = f"postgresql+asyncpg://{DATABASE_READ_USER}:{quote_plus(DATABASE_READ_PASSWORD)}@{DATABASE_READ_HOST}:{DATABASE_READ_PORT}/{DATABASE_NAME}"
+    read_engine = create_async_engine(
+        READ_DATABASE_URL,
+        echo = False,
+        connect_args=CONNECT_ARGS,
+        pool_size=READ_DB_POOL_SIZE,
+        max_overflow=0,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+    )
+else:
+    read_engine = engine
+
+# Read-your-writes deadline (unix time), set by note_write() on the client as
+# a cookie and a response header. It comes back with the client's next
+# request whichever worker serves it; clients without a cookie jar echo the
+# header instead.
+PRIMARY_PIN_COOKIE = "ngl_primary_until"
+PRIMARY_PIN_HEADER = "X-Primary-Until"
+_reads_replica = 0
+_reads_primary = 0
+
+
+def note_write(response: Response):
+    """Pin this client's reads to the primary for READ_YOUR_WRITES_SECONDS, on every worker."""
+    if read_engine is engine:
+        return
+    deadline = f"{time.time() + READ_YOUR_WRITES_SECONDS:.3f}"
+    response.set_cookie(
+        key=PRIMARY_PIN_COOKIE,
+        value=deadline,
+        max_age=math.ceil(READ_YOUR_WRITES_SECONDS),
+        httponly=True,
+        secure=os.getenv("IS_PRODUCTION") == "True",
+        samesite="lax",
+    )
+    response.headers[PRIMARY_PIN_HEADER] = deadline
+
+
+def wrote_recently(request: Request | None) -> bool:
+    if request is None:
+        return False
+    raw = request.headers.get(PRIMARY_PIN_HEADER) or request.cookies.get(PRIMARY_PIN_COOKIE)
+    try:
+        deadline = float(raw) if raw else 0.0
+    except ValueError:
+        return False
+    now = time.time()
+    # A forged value can only pin its own client, and no longer than a real write
+    return now < deadline <= now + READ_YOUR_WRITES_SECONDS + 1
+
+
+class RoutingSession(Session):
+    """
+    Picks the engine per statement: the replica for plain reads, the
+    primary for writes and for clients inside their read-your-writes window
+    (the note_write() pin on the request), so dependency order doesn't matter.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        global _reads_replica, _reads_primary
+        if read_engine is engine or self._flushing or isinstance(clause, (Insert, Update, Delete)):
+            return engine.sync_engine
+        if wrote_recently(self.info.get("request")):
+            _reads_primary += 1
+            return engine.sync_engine
+        _reads_replica += 1
+        return read_engine.sync_engine
+
+
+AsyncReadSessionLocal = async_sessionmaker(
+    class_=AsyncSession,
+    sync_session_class=RoutingSession,
+    expire_on_commit=False,
+    autoflush=False,
+)
+
+
+def db_pool_stats() -> dict:
+    pool = engine.pool
+    return {"size": pool.size(), "checked_out": pool.checkedout(), "overflow": pool.overflow()}
+
+
+def read_routing_stats() -> dict:
+    return {
+        "replica_configured": read_engine is not engine,
+        "reads_replica": _reads_replica,
+        "reads_primary_after_write": _reads_primary,
+    }
+
 Base = declarative_base()
 
 class User(Base):
@@ -53,6 +188,13 @@ class User(Base):
     password = Column(String, nullable = True)  # Nullable for OAuth users
     email = Column(String(50), unique=True, index=False, nullable = True)  # Nullable for non-OAuth users
     fcm_tokens = Column(ARRAY(String), nullable = True)  # List of FCM tokens for the user
+    # Inbox badge counters, maintained by counters.py; reconcile with `python -m ngl.reconcile_counters`
+    message_count = Column(Integer, default=0, server_default="0", nullable = False)
+    unread_count = Column(Integer, default=0, server_default="0", nullable = False)
+    # Bumped with every counter change; the inbox ETag is derived from it
+    inbox_version = Column(BigInteger, default=0, server_default="0", nullable = False)
+    # Set by delete_account; account_deletion.py removes the row once its messages are gone
+    deleted_at = Column(DateTime(timezone=True), nullable = True)
 
     # messages = relationship("Message", back_populates='user', lazy="selectin")
     
@@ -61,16 +203,80 @@ class User(Base):
 class Message(Base):
     __tablename__ = "messages"
     id = Column(Integer, primary_key=True, index=True, nullable = False)
-    user_id = Column(String, ForeignKey("users.id"), index=True, nullable = False)
+    user_id = Column(String, ForeignKey("users.id"), nullable = False)  # covered by ix_messages_user_id_id_desc
     content = Column(String, nullable = False)
-    time = Column(String, nullable = False)
+    time = Column(DateTime(timezone=True), server_default=func.now(), nullable = False)
     unread = Column(Boolean, default=True)  # True for unread, False for read
 
+    # Existing databases: python -m ngl.migrate_messages
+    __table_args__ = (
+        # Inbox listing: WHERE user_id = ? ORDER BY id DESC
+        Index("ix_messages_user_id_id_desc", "user_id", desc("id")),
+        # Unread lookups only ever touch the (small) unread subset
+        Index("ix_messages_user_id_unread", "user_id", postgresql_where=(unread == True)),
+    )
+
     # user = relationship("User", back_populates='messages', lazy="selectin")
 
-async def get_db():
-    async with AsyncSessionLocal() as db:
-        yield db
+
+class MessageArchive(Base):
+    """
+    Messages moved out of the live table by retention.py (RETENTION_ARCHIVE=True).
+    Append-only and never read by the API, so no user index and no read flag.
+    """
+    __tablename__ = "messages_archive"
+    id = Column(Integer, primary_key=True, nullable = False)  # the original Message.id
+    user_id = Column(String, nullable = False)
+    content = Column(String, nullable = False)
+    time = Column(DateTime(timezone=True), nullable = False)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now(), nullable = False)
+
+
+class AccountDeletion(Base):
+    """
+    Deletion queue and progress record, one row per deleted account. Kept
+    after the user row is gone (no foreign key) so progress stays readable.
+    """
+    __tablename__ = "account_deletions"
+    user_id = Column(String, primary_key=True, nullable = False)
+    requested_at = Column(DateTime(timezone=True), server_default=func.now(), nullable = False)
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.now(), nullable = False)
+    messages_total = Column(Integer, default=0, nullable = False)  # message_count when requested
+    messages_deleted = Column(Integer, default=0, server_default="0", nullable = False)
+    completed_at = Column(DateTime(timezone=True), nullable = True)
+
+
+class NotificationOutbox(Base):
+    """
+    Pending FCM notifications. Rows are written in the same transaction as the
+    Message they announce and drained by the dispatcher in notifications.py.
+    """
+    __tablename__ = "notification_outbox"
+    id = Column(BigInteger, primary_key=True, index=True, nullable = False)
+    user_id = Column(String, index=True, nullable = False)
+    payload = Column(JSON, nullable = False)  # FCM data dict
+    tokens = Column(ARRAY(String), nullable = True)  # None -> all of the user's current tokens
+    attempts = Column(Integer, default=0, nullable = False)
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.now(), index=True, nullable = False)
+
+admission.configure(DB_POOL_SIZE)
+if read_engine is not engine:
+    admission.configure(READ_DB_POOL_SIZE, "replica", reserved=0)
+
+async def get_db(request: Request = None):
+    # Waits for (or is refused) an admission slot before touching the pool
+    async with admission.admit(request):
+        async with AsyncSessionLocal() as db:
+            yield db
+
+async def get_read_db(request: Request = None):
+    """
+    Session for read-only routes: the replica if DATABASE_READ_HOST is set,
+    otherwise the primary. Call note_write(response) after inbox writes.
+    """
+    async with admission.admit(request, "primary" if read_engine is engine else "replica"):
+        async with AsyncReadSessionLocal(info={"request": request}) as db:
+            yield db
 
 
 class GoogleUsers(Base):
@@ -79,3 +285,52 @@ class GoogleUsers(Base):
     user_id = Column(String, ForeignKey("users.id"), index=False, nullable = False)
 
     user = relationship("User", lazy="selectin")
+
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+    version = Column(Integer, primary_key=True, nullable = False)
+
+
+async def column_type(conn, table: str, column: str) -> str | None:
+    return await conn.scalar(text(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = :t AND column_name = :c"
+    ), {"t": table, "c": column})
+
+
+async def ensure_schema() -> str:
+    """
+    Startup check: a single SELECT when the database is at SCHEMA_VERSION.
+    Otherwise create the missing tables and apply SCHEMA_UPGRADES under an
+    advisory lock (so workers booting together don't race) and record the
+    version. Returns
+    "current", "created" or "newer" (database ahead of this code).
+    Raises RuntimeError while messages.time still needs migrate_messages.py.
+    """
+    async with engine.connect() as conn:
+        try:
+            current = await conn.scalar(select(func.max(SchemaVersion.version)))
+        except ProgrammingError:  # no schema_version table: new database, or one from before it existed
+            current = None
+    if current is not None and current >= SCHEMA_VERSION:
+        return "current" if current == SCHEMA_VERSION else "newer"
+
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('ngl.ensure_schema'))"))
+        if await column_type(conn, "messages", "time") == "character varying":
+            raise RuntimeError(
+                "messages.time is still VARCHAR; run `python -m ngl.migrate_messages` "
+                f"before starting this version (schema {SCHEMA_VERSION})"
+            )
+        recount = (
+            await column_type(conn, "users", "id") is not None
+            and await column_type(conn, "users", "message_count") is None
+        )
+        await conn.run_sync(Base.metadata.create_all)
+        for statement in SCHEMA_UPGRADES:
+            await conn.execute(text(statement))
+        if recount:
+            await conn.execute(text(_RECOUNT_INBOX_COUNTERS))
+        await conn.execute(pg_insert(SchemaVersion).values(version=SCHEMA_VERSION).on_conflict_do_nothing())
+    return "created"
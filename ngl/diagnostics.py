@@ -0,0 +1,171 @@
+# diagnostics.py
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import signal
+from contextlib import suppress
+
+from .loop_watchdog import loop_watchdog
+from . import timer
+
+logger = logging.getLogger("checkpoint")
+
+# Knobs each level sets. watchdog_period_ms=None means no watchdog at all.
+PROFILES = {
+    "off": {
+        "asyncio_debug": False,
+        "slow_callback_ms": 100,
+        "watchdog_period_ms": None,
+        "watchdog_warn_ms": 100,
+        "timer_sample_rate": 0.0,
+        "timer_log_mode": "off",
+    },
+    "light": {
+        "asyncio_debug": False,
+        "slow_callback_ms": 100,
+        "watchdog_period_ms": 100,
+        "watchdog_warn_ms": 100,
+        "timer_sample_rate": 1.0,
+        "timer_log_mode": "slow",
+    },
+    "full": {
+        "asyncio_debug": True,
+        "slow_callback_ms": 50,
+        "watchdog_period_ms": 20,
+        "watchdog_warn_ms": 100,
+        "timer_sample_rate": 1.0,
+        "timer_log_mode": "each",
+    },
+}
+
+DEFAULT_LEVEL = os.getenv("DIAGNOSTICS_LEVEL", "light")
+# Exported by the ngl.serve supervisor to its workers. update() writes the
+# new profile here and signals the supervisor, which forwards SIGUSR1 to
+# every worker; each re-applies the file. Unset: changes stay in one process.
+SHARED_FILE = os.getenv("DIAGNOSTICS_SHARED_FILE")
+SUPERVISOR_PID = int(os.getenv("NGL_SUPERVISOR_PID", "0"))
+
+_level: str | None = None
+_settings: dict = {}
+_watchdog_task: asyncio.Task | None = None
+_applied_version = 0
+
+
+async def _stop_watchdog():
+    global _watchdog_task
+    if _watchdog_task is None:
+        return
+    _watchdog_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await _watchdog_task
+    _watchdog_task = None
+
+
+async def apply(level: str, **overrides) -> dict:
+    """
+    Switch to a profile (plus optional per-knob overrides) on the running loop.
+    Safe to call repeatedly: there is never more than one watchdog task.
+    """
+    global _level, _settings, _watchdog_task
+    if level not in PROFILES:
+        raise ValueError(f"unknown diagnostics level {level!r}")
+    unknown = set(overrides) - set(PROFILES[level])
+    if unknown:
+        raise ValueError(f"unknown diagnostics settings {sorted(unknown)}")
+    settings = {**PROFILES[level], **{k: v for k, v in overrides.items() if v is not None}}
+
+    loop = asyncio.get_running_loop()
+    loop.set_debug(settings["asyncio_debug"])
+    loop.slow_callback_duration = settings["slow_callback_ms"] / 1000.0
+
+    timer.configure(sample_rate=settings["timer_sample_rate"], log_mode=settings["timer_log_mode"])
+
+    watchdog = (settings["watchdog_period_ms"], settings["watchdog_warn_ms"])
+    current = (_settings.get("watchdog_period_ms"), _settings.get("watchdog_warn_ms"))
+    if _watchdog_task is None or _watchdog_task.done() or watchdog != current:
+        await _stop_watchdog()
+        if settings["watchdog_period_ms"]:
+            _watchdog_task = loop.create_task(
+                loop_watchdog(period_ms=settings["watchdog_period_ms"], warn_ms=settings["watchdog_warn_ms"])
+            )
+
+    _level, _settings = level, settings
+    logger.info(f"[diagnostics] level={level} {settings}")
+    return current_profile()
+
+
+def _read_shared() -> dict | None:
+    try:
+        with open(SHARED_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+async def _reload():
+    global _applied_version
+    shared = _read_shared()
+    if shared is None or shared["version"] <= _applied_version:
+        return
+    try:
+        await apply(shared["level"], **shared["overrides"])
+    except ValueError as e:
+        logger.warning(f"[diagnostics] ignoring shared profile: {e}")
+    _applied_version = shared["version"]
+
+
+async def start():
+    """Lifespan startup: the shared profile if workers already changed it, else DIAGNOSTICS_LEVEL."""
+    await apply(DEFAULT_LEVEL)
+    if SHARED_FILE:
+        loop = asyncio.get_running_loop()
+        # Installed before reading the file, so a change made meanwhile isn't missed
+        loop.add_signal_handler(signal.SIGUSR1, lambda: loop.create_task(_reload()))
+        await _reload()
+
+
+async def update(level: str, **overrides) -> dict:
+    """
+    PUT /admin/diagnostics: apply here (raising ValueError if invalid), then
+    hand the profile to every other worker when running under ngl.serve.
+    """
+    global _applied_version
+    await apply(level, **overrides)
+    if SHARED_FILE and SUPERVISOR_PID:
+        _applied_version = await asyncio.to_thread(_publish, level, overrides)
+        os.kill(SUPERVISOR_PID, signal.SIGUSR1)
+    return current_profile()
+
+
+def _publish(level: str, overrides: dict) -> int:
+    """Write the next version of the shared profile; returns that version."""
+    # Workers PUTting at once would otherwise read the same version and
+    # both write version + 1, and the others would skip the second change.
+    with open(f"{SHARED_FILE}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        shared = _read_shared()
+        version = (shared["version"] if shared else 0) + 1
+        tmp = f"{SHARED_FILE}.{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump({"version": version, "level": level, "overrides": overrides}, f)
+        os.replace(tmp, SHARED_FILE)
+    return version
+
+
+def current_profile() -> dict:
+    return {
+        "level": _level,
+        "settings": _settings,
+        "watchdog_running": _watchdog_task is not None and not _watchdog_task.done(),
+        # Which worker answered, and whether the change reaches the others
+        "pid": os.getpid(),
+        "scope": "all workers" if SHARED_FILE and SUPERVISOR_PID else "this worker",
+    }
+
+
+async def shutdown():
+    if SHARED_FILE:
+        asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+    await _stop_watchdog()
@@ -1,10 +1,61 @@
 from passlib.context import CryptContext
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, status
+import asyncio
+import os
 
 pwd_context = CryptContext(schemes=['bcrypt'], deprecated="auto")
 
+# bcrypt releases the GIL while hashing, so a small thread pool keeps the
+# ~250ms of CPU per call off the event loop without a process pool's IPC.
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "64"))  # queued + running
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+_depth = 0
+_max_depth = 0
+_completed = 0
+_rejected = 0
+
+
+async def _offload(fn, *args):
+    global _depth, _max_depth, _completed, _rejected
+    if _depth >= HASH_QUEUE_LIMIT:
+        _rejected += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+    _depth += 1
+    _max_depth = max(_max_depth, _depth)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    finally:
+        _depth -= 1
+        _completed += 1
+
+
+def stats() -> dict:
+    return {
+        "workers": HASH_WORKERS,
+        "queue_limit": HASH_QUEUE_LIMIT,
+        "queue_depth": _depth,
+        "max_queue_depth": _max_depth,
+        "completed": _completed,
+        "rejected": _rejected,
+    }
+
+
 class Hash():
     def bcrypt( password: str) -> str:
         return pwd_context.hash(password)
 
     def verify(plain_password: str, hashed_password: str) -> bool:
-        return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+        return pwd_context.verify(plain_password, hashed_password)
+
+    async def bcrypt_async(password: str) -> str:
+        return await _offload(pwd_context.hash, password)
+
+    async def verify_async(plain_password: str, hashed_password: str) -> bool:
+        return await _offload(pwd_context.verify, plain_password, hashed_password)
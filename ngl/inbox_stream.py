@@ -0,0 +1,88 @@
+# inbox_stream.py
+import asyncio
+import os
+
+# Fan-out is in-process: a client only hears about messages sent through the
+# worker it is connected to. Anything it misses it picks up from /recieving/inbox.
+STREAM_QUEUE_LIMIT = int(os.getenv("STREAM_QUEUE_LIMIT", "100"))
+MAX_STREAMS_PER_USER = int(os.getenv("MAX_STREAMS_PER_USER", "5"))
+STREAM_SKIPS_FCM = os.getenv("STREAM_SKIPS_FCM", "True") == "True"
+
+_subscribers: dict[str, set["Subscription"]] = {}
+_published = 0
+_delivered = 0
+_overflowed = 0
+
+
+class TooManyStreams(Exception):
+    pass
+
+
+class Subscription:
+    """One connected client. A client that falls STREAM_QUEUE_LIMIT events behind is cut off."""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_LIMIT)
+        self.overflowed = False
+
+    def offer(self, event: dict) -> bool:
+        global _overflowed
+        if self.overflowed:
+            return False
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            # Don't buffer without bound for a slow reader; close it so it re-syncs.
+            self.overflowed = True
+            _overflowed += 1
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            return False
+
+    async def next(self) -> dict | None:
+        """Next event, or None once the subscription has overflowed."""
+        return await self.queue.get()
+
+
+def subscribe(user_id: str) -> Subscription:
+    subs = _subscribers.setdefault(user_id, set())
+    if len(subs) >= MAX_STREAMS_PER_USER:
+        raise TooManyStreams(user_id)
+    sub = Subscription(user_id)
+    subs.add(sub)
+    return sub
+
+
+def unsubscribe(sub: Subscription):
+    subs = _subscribers.get(sub.user_id)
+    if subs is None:
+        return
+    subs.discard(sub)
+    if not subs:
+        del _subscribers[sub.user_id]
+
+
+def has_subscribers(user_id: str) -> bool:
+    return user_id in _subscribers
+
+
+def publish(user_id: str, event: dict) -> int:
+    """Push an event to every stream of user_id. Returns how many accepted it."""
+    global _published, _delivered
+    _published += 1
+    delivered = sum(1 for sub in tuple(_subscribers.get(user_id, ())) if sub.offer(event))
+    _delivered += delivered
+    return delivered
+
+
+def stats() -> dict:
+    return {
+        "active_users": len(_subscribers),
+        "active_streams": sum(len(subs) for subs in _subscribers.values()),
+        "published": _published,
+        "delivered": _delivered,
+        "overflowed": _overflowed,
+        "queue_limit": STREAM_QUEUE_LIMIT,
+    }
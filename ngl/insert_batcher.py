@@ -0,0 +1,153 @@
+# insert_batcher.py
+import asyncio
+import logging
+import os
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from .database import AsyncSessionLocal, Message, NotificationOutbox
+from . import counters
+
+logger = logging.getLogger("insert_batcher")
+
+ENABLED = os.getenv("MESSAGE_INSERT_BATCHING", "False") == "True"
+MAX_ROWS = int(os.getenv("MESSAGE_BATCH_MAX_ROWS", "100"))
+MAX_DELAY_MS = float(os.getenv("MESSAGE_BATCH_MAX_DELAY_MS", "5"))
+MAX_CONCURRENT_FLUSHES = int(os.getenv("MESSAGE_BATCH_FLUSHERS", "4"))
+
+# (message row, outbox payload or None, future resolved with the message id)
+_pending: list[tuple[dict, dict | None, asyncio.Future]] = []
+_has_items: asyncio.Event | None = None
+_is_full: asyncio.Event | None = None
+_flush_slots: asyncio.Semaphore | None = None
+_flusher: asyncio.Task | None = None
+_inflight: set[asyncio.Task] = set()
+# Set by stop(); later submits insert on their own instead of restarting the flusher
+_stopping = False
+
+
+async def submit(user_id: str, content: str, time: datetime, notification: dict | None = None) -> int:
+    """
+    Queue a message for the next batch and wait until the batch has committed.
+    Returns the new message id. Raises whatever the batch insert raised.
+    """
+    row = {"user_id": user_id, "content": content, "time": time}
+    if _stopping:
+        return (await _insert([(row, notification, None)]))[0]
+    if _flusher is None:
+        start()
+    fut = asyncio.get_running_loop().create_future()
+    _pending.append((row, notification, fut))
+    _has_items.set()
+    if len(_pending) >= MAX_ROWS:
+        _is_full.set()
+    return await fut
+
+
+async def _insert(batch) -> list[int]:
+    async with AsyncSessionLocal() as db:
+        ids = (await db.scalars(
+            insert(Message).returning(Message.id, sort_by_parameter_order=True),
+            [row for row, _, _ in batch]
+        )).all()
+        outbox = [
+            {"user_id": row["user_id"], "payload": payload}
+            for row, payload, _ in batch if payload is not None
+        ]
+        if outbox:
+            await db.execute(insert(NotificationOutbox), outbox)
+        deltas: dict[str, tuple[int, int]] = {}
+        for row, _, _ in batch:
+            total, unread = deltas.get(row["user_id"], (0, 0))
+            deltas[row["user_id"]] = (total + 1, unread + 1)
+        await counters.bump_many(db, deltas)
+        await db.commit()
+    return ids
+
+
+def _resolve(batch, ids):
+    for (_, _, fut), msg_id in zip(batch, ids):
+        if not fut.done():
+            fut.set_result(msg_id)
+
+
+def _fail(batch, e: Exception):
+    for _, _, fut in batch:
+        if not fut.done():
+            fut.set_exception(e)
+
+
+async def _write(batch):
+    try:
+        try:
+            _resolve(batch, await _insert(batch))
+            return
+        except Exception as e:
+            logger.warning(f"[batch] insert of {len(batch)} messages failed: {e}")
+            if len(batch) == 1:
+                _fail(batch, e)
+                return
+        # One bad row (a recipient deleted meanwhile, say) must not fail every
+        # other sender in the batch: retry row by row and fail only the culprits.
+        for item in batch:
+            try:
+                _resolve([item], await _insert([item]))
+            except Exception as e:
+                logger.warning(f"[batch] insert for {item[0]['user_id']} failed: {e}")
+                _fail([item], e)
+    finally:
+        _flush_slots.release()
+
+
+async def _run():
+    loop = asyncio.get_running_loop()
+    while True:
+        await _has_items.wait()
+        # Give concurrent requests a few ms to join, unless the batch is already full.
+        if len(_pending) < MAX_ROWS:
+            try:
+                await asyncio.wait_for(_is_full.wait(), timeout=MAX_DELAY_MS / 1000.0)
+            except asyncio.TimeoutError:
+                pass
+
+        await _flush_slots.acquire()
+        batch = _pending[:MAX_ROWS]
+        del _pending[:MAX_ROWS]
+        if not _pending:
+            _has_items.clear()
+        if len(_pending) < MAX_ROWS:
+            _is_full.clear()
+
+        task = loop.create_task(_write(batch))
+        _inflight.add(task)
+        task.add_done_callback(_inflight.discard)
+
+
+def start():
+    global _has_items, _is_full, _flush_slots, _flusher, _stopping
+    if _flusher is not None:
+        return
+    _stopping = False
+    _has_items = asyncio.Event()
+    _is_full = asyncio.Event()
+    _flush_slots = asyncio.Semaphore(MAX_CONCURRENT_FLUSHES)
+    _flusher = asyncio.get_running_loop().create_task(_run())
+    logger.info(f"[batch] message insert batching on (max_rows={MAX_ROWS}, max_delay={MAX_DELAY_MS}ms)")
+
+
+async def stop():
+    """Stop accepting new batches, then let queued and in-flight inserts finish."""
+    global _flusher, _stopping
+    if _flusher is None:
+        return
+    _stopping = True
+    _flusher.cancel()
+    await asyncio.gather(_flusher, return_exceptions=True)
+    _flusher = None
+    while _pending:
+        await _flush_slots.acquire()
+        batch = _pending[:MAX_ROWS]
+        del _pending[:MAX_ROWS]
+        await _write(batch)
+    await asyncio.gather(*_inflight, return_exceptions=True)
@@ -2,6 +2,12 @@
 import asyncio
 import time
 import logging
+import os
+import sys
+import threading
+import traceback
+from collections import Counter, deque
+from . import metrics
 
 logger = logging.getLogger("checkpoint")
 
@@ -12,21 +18,114 @@ def get_loop_lag_snapshot():
     """Return (latest_lag_ms, timestamp_perf_counter)."""
     return _loop_lag_ms, _loop_lag_last_ts
 
+def get_loop_lag_histogram():
+    """Distribution of every lag sample so far (the snapshot above is only the latest)."""
+    h = metrics.loop_lag.get(())
+    return {
+        "samples": h.count,
+        "mean_ms": round(h.sum / h.count * 1000.0, 3) if h.count else None,
+        "p50_ms_le": _ms(h.quantile(0.5)),
+        "p99_ms_le": _ms(h.quantile(0.99)),
+        "p999_ms_le": _ms(h.quantile(0.999)),
+        "buckets_ms": {_ms(b): c for b, c in zip(metrics.BUCKETS + (float("inf"),), h.counts)},
+    }
+
+def _ms(seconds):
+    return None if seconds is None else ("inf" if seconds == float("inf") else seconds * 1000.0)
+
+
+# ---------------------------------------------------------------------------
+# Stall sampler: a plain thread that notices when the watchdog heartbeat is
+# overdue and grabs the event-loop thread's Python stack while it is stuck.
+# ---------------------------------------------------------------------------
+STALL_SAMPLE_MS = float(os.getenv("STALL_SAMPLE_MS", "10"))
+STALL_STACK_DEPTH = int(os.getenv("STALL_STACK_DEPTH", "12"))
+STALL_CAPTURES_KEPT = int(os.getenv("STALL_CAPTURES_KEPT", "50"))
+
+_heartbeat = 0.0                    # perf_counter of the watchdog's last tick
+_loop_thread_id: int | None = None
+_stall_thread: threading.Thread | None = None
+_stall_stop = threading.Event()
+_stall_captures: deque = deque(maxlen=STALL_CAPTURES_KEPT)
+_stall_frames: Counter = Counter()  # "file:line in func" of the innermost frame -> samples
+_stall_stacks: Counter = Counter()  # whole (trimmed) stack -> samples
+
+def _capture_loop_stack():
+    frame = sys._current_frames().get(_loop_thread_id)
+    if frame is None:
+        return None
+    stack = traceback.extract_stack(frame, limit=STALL_STACK_DEPTH)
+    return tuple(f"{f.filename}:{f.lineno} in {f.name}" for f in stack)
+
+def _stall_sampler(threshold_s: float, stop: threading.Event):
+    in_stall = False
+    while not stop.wait(STALL_SAMPLE_MS / 1000.0):
+        overdue = time.perf_counter() - _heartbeat
+        if overdue < threshold_s:
+            in_stall = False
+            continue
+        stack = _capture_loop_stack()
+        if not stack:
+            continue
+        _stall_frames[stack[-1]] += 1
+        _stall_stacks[stack] += 1
+        if not in_stall:
+            # First sample of this stall: that is where the loop got stuck.
+            in_stall = True
+            _stall_captures.append({
+                "at": time.time(),
+                "overdue_ms": round(overdue * 1000.0, 1),
+                "stack": list(stack),
+            })
+            logger.warning(f"[loop] blocked {overdue * 1000.0:.0f}ms at {stack[-1]}")
+
+def _start_stall_sampler(threshold_s: float):
+    global _stall_thread, _stall_stop, _loop_thread_id
+    if _stall_thread is not None and _stall_thread.is_alive():
+        return
+    _loop_thread_id = threading.get_ident()
+    _stall_stop = threading.Event()
+    _stall_thread = threading.Thread(target=_stall_sampler, args=(threshold_s, _stall_stop), name="loop-stall-sampler", daemon=True)
+    _stall_thread.start()
+
+def _stop_stall_sampler():
+    global _stall_thread
+    _stall_stop.set()
+    _stall_thread = None
+
+def get_stall_report(top: int = 20):
+    return {
+        "recent": list(reversed(_stall_captures)),
+        "top_frames": [{"frame": f, "samples": n} for f, n in _stall_frames.most_common(top)],
+        "top_stacks": [{"stack": list(s), "samples": n} for s, n in _stall_stacks.most_common(min(top, 5))],
+        "sample_interval_ms": STALL_SAMPLE_MS,
+        "lag": get_loop_lag_histogram(),
+    }
+
 async def loop_watchdog(period_ms: int = 20, warn_ms: int = 50):
     """
     Periodically measures event-loop lag. If the loop is blocked by sync work
     (e.g., time.sleep or CPU-heavy code), lag spikes. During proper 'await's,
     lag remains small.
+    Also runs the stall sampler thread, which records what the loop thread
+    was executing whenever a tick is more than warn_ms overdue.
     """
-    global _loop_lag_ms, _loop_lag_last_ts
+    global _loop_lag_ms, _loop_lag_last_ts, _heartbeat
     period = period_ms / 1000.0
     expected = time.perf_counter()
-    while True:
-        expected += period
-        await asyncio.sleep(max(0.0, expected - time.perf_counter()))
-        now = time.perf_counter()
-        lag = max(0.0, (now - expected) * 1000.0)  # milliseconds
-        _loop_lag_ms = lag
-        _loop_lag_last_ts = now
-        if lag >= warn_ms:
-            logger.warning(f"[loop] lag={lag:.1f}ms (event loop likely blocked)")
+    _heartbeat = expected
+    _start_stall_sampler((period_ms + warn_ms) / 1000.0)
+    try:
+        while True:
+            expected += period
+            await asyncio.sleep(max(0.0, expected - time.perf_counter()))
+            now = time.perf_counter()
+            _heartbeat = now
+            lag = max(0.0, (now - expected) * 1000.0)  # milliseconds
+            _loop_lag_ms = lag
+            _loop_lag_last_ts = now
+            metrics.observe_loop_lag(lag / 1000.0)
+            if lag >= warn_ms:
+                logger.warning(f"[loop] lag={lag:.1f}ms (event loop likely blocked)")
+    finally:
+        _stop_stall_sampler()
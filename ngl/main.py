@@ -1,21 +1,26 @@
+from . import startup  # first, so the import phase is timed from here
 from fastapi import FastAPI, status, HTTPException, Depends, Request, Response
 from contextlib import asynccontextmanager, suppress
 from fastapi.middleware.cors import CORSMiddleware
+startup.mark("import fastapi")
 
 from .database import *
+startup.mark("import database")
 from . import router, schema
+startup.mark("import routers")
 from fastapi.responses import FileResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from . import oAuthentication
 # from starlette.middleware.sessions import SessionMiddleware
-import firebase_admin as fbad
 
 from pathlib import Path
 import logging
+import os
 
-from .loop_watchdog import loop_watchdog
+from . import diagnostics, notifications, insert_batcher, retention, account_deletion, user_cache, hashing, inbox_stream, metrics, rate_limit, admission
 import asyncio
 from .timer import *
+startup.mark("import other modules")
 
 
 # -------------------------
@@ -34,41 +39,52 @@ if not checkpoint_logger.handlers:
 checkpoint_logger.setLevel(logging.INFO)
 checkpoint_logger.propagate = False  # avoid double logs
 
-cred = fbad.credentials.Certificate("serviceAccountKey.json")
-fbad.initialize_app(cred)
-
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     - Startup:
-        * ensure DB tables exist
-        * start loop watchdog
+        * apply the diagnostics profile (DIAGNOSTICS_LEVEL: off/light/full),
+          which owns asyncio debug mode and the single loop watchdog
+        * check the schema version (creates tables only on a new/old database)
+        * start FCM outbox dispatcher, which initialises Firebase in the background
+        * start message insert batcher (if enabled)
+        * start the message retention job (if enabled)
+        * start the account deletion worker
+        * log the startup timing report (GET /admin/startup-stats)
     - Shutdown:
+        * stop the retention job and the account deletion worker
+        * flush message insert batcher
+        * stop FCM outbox dispatcher
         * stop loop watchdog
     """
-    # Start watchdog first so we can see any long startup steps as lag:
-    loop = asyncio.get_running_loop()
-    try:
-        loop.set_debug(True)
-        loop.slow_callback_duration = 0.05  # 50ms
-    except Exception:
-        pass
-    watchdog_task = loop.create_task(loop_watchdog(period_ms=20, warn_ms=100))
-    checkpoint_logger.info("[lifespan] loop watchdog started")
-
-    # Your original startup step: create tables
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    checkpoint_logger.info("[lifespan] database tables ensured")
+    # Apply diagnostics first so the watchdog sees any long startup steps as lag:
+    with startup.step("diagnostics"):
+        await diagnostics.start()
+
+    with startup.step("schema check"):
+        schema_state = await ensure_schema()
+    if schema_state != "current":
+        checkpoint_logger.info(f"[lifespan] database schema {schema_state} (version {SCHEMA_VERSION})")
+
+    with startup.step("background tasks"):
+        notifications.start_dispatcher()
+        if insert_batcher.ENABLED:
+            insert_batcher.start()
+        if retention.RETENTION_ENABLED:
+            retention.start()
+        account_deletion.start()
+    startup.ready()
 
     try:
         yield
     finally:
+        await retention.stop()
+        await account_deletion.stop()
+        await insert_batcher.stop()
+        await notifications.stop_dispatcher()
         checkpoint_logger.info("[lifespan] shutting down loop watchdog...")
-        watchdog_task.cancel()
-        with suppress(asyncio.CancelledError):
-            await watchdog_task
+        await diagnostics.shutdown()
 
 
 app = FastAPI(
@@ -85,17 +101,17 @@ async def timing_middleware(request: Request, call_next):
     Per-request total timing (in addition to in-route checkpoints).
     """
     t = CheckTimer(f"{request.method} {request.url.path}")
+    status_code = 500
     try:
         response = await call_next(request)
+        status_code = response.status_code
         return response
     finally:
-        t.cp("response_sent")
-
-@app.on_event("startup")
-async def _start_watchdog():
-    loop = asyncio.get_running_loop()
-    loop.set_debug(True)  # optional: asyncio will log slow callbacks
-    loop.create_task(loop_watchdog(period_ms=20, warn_ms=100))
+        # Aggregate by route template, not raw path, so /sending/{user_id} is one series
+        route = request.scope.get("route")
+        t.name = f"{request.method} {route.path if route else 'unmatched'}"
+        t.finish("response_sent")
+        metrics.count_request(t.name, status_code)
 
 templates = Jinja2Templates(directory="pages")
 
@@ -155,6 +171,7 @@ app.include_router(router.sending.router)
 app.include_router(router.authentication.router)
 
 app.include_router(router.receiving.router)
+app.include_router(router.admin.router)
 
 # @app.get("/signup")
 # async def signup_page():
@@ -178,14 +195,28 @@ app.include_router(router.receiving.router)
 async def get_memory_usages():
     return await memory_usages()
 
+metrics.register_gauges("ngl_user_cache", user_cache.stats)
+metrics.register_gauges("ngl_hash_queue", hashing.stats)
+metrics.register_gauges("ngl_jwt_cache", oAuthentication.jwt_cache_stats)
+metrics.register_gauges("ngl_inbox_stream", inbox_stream.stats)
+metrics.register_gauges("ngl_rate_limit", rate_limit.stats)
+metrics.register_gauges("ngl_retention", retention.stats)
+metrics.register_gauges("ngl_account_deletion", account_deletion.stats)
+metrics.register_gauges("ngl_db_admission", admission.stats)
+metrics.register_gauges("ngl_db_pool", db_pool_stats)
+metrics.register_gauges("ngl_db_replica_admission", lambda: admission.stats("replica"))
+metrics.register_gauges("ngl_db_read_routing", read_routing_stats)
+
+metrics.register_gauges("ngl_startup", startup.stats)
+
 @app.get("/Ads.txt")
 async def ads_txt():
     return FileResponse("pages/ads.txt", media_type="text/plain")
 
 
 @app.get('/{user_id}', status_code=status.HTTP_200_OK, response_model=schema.ShowUserOnly)
-async def get_user(user_id: str, request : Request, db: AsyncSession = Depends(get_db)):
-    user = await db.get(User, user_id.lower())
+async def get_user(user_id: str, request : Request, db: AsyncSession = Depends(get_read_db)):
+    user = await user_cache.get_user(db, user_id.lower())
     if user:
         return templates.TemplateResponse("send.html", {
                 "request": request,
@@ -196,3 +227,6 @@ async def get_user(user_id: str, request : Request, db: AsyncSession = Depends(g
     
 
 
+
+
+startup.mark("build app")
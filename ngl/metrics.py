@@ -0,0 +1,151 @@
+# metrics.py
+"""
+In-process metrics with Prometheus text export.
+
+Histograms have fixed buckets and are plain lists of ints, so recording a
+sample is a bisect plus a few integer adds: no per-sample objects. Series are
+created on first use and capped at MAX_SERIES; extra label sets fold into an
+"other" series instead of growing memory.
+"""
+import os
+from bisect import bisect_left
+
+MAX_SERIES = int(os.getenv("METRICS_MAX_SERIES", "2000"))
+
+# Seconds. Covers sub-millisecond CPU segments up to multi-second stalls.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_BUCKET_LABELS = tuple(repr(b) for b in BUCKETS) + ("+Inf",)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        """Upper bound of the bucket holding the q-th sample (what histogram_quantile would approximate)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else float("inf")
+        return float("inf")
+
+
+class HistogramFamily:
+    """Histograms sharing a name, keyed by a tuple of label values."""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series: dict[tuple, Histogram] = {}
+
+    def get(self, key: tuple) -> Histogram:
+        h = self.series.get(key)
+        if h is None:
+            if len(self.series) >= MAX_SERIES:
+                key = ("other",) * len(self.labels)
+                h = self.series.get(key)
+            if h is None:
+                h = self.series[key] = Histogram()
+        return h
+
+    def render(self, out: list[str]):
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} histogram")
+        for key, h in list(self.series.items()):
+            base = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.labels, key))
+            sep = "," if base else ""
+            cumulative = 0
+            for le, c in zip(_BUCKET_LABELS, h.counts):
+                cumulative += c
+                out.append(f'{self.name}_bucket{{{base}{sep}le="{le}"}} {cumulative}')
+            label_block = f"{{{base}}}" if base else ""
+            out.append(f"{self.name}_sum{label_block} {h.sum!r}")
+            out.append(f"{self.name}_count{label_block} {h.count}")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# CheckTimer segments, labelled by timer name and checkpoint label
+checkpoint_wall = HistogramFamily("ngl_checkpoint_wall_seconds", "Wall time of a CheckTimer segment.", ("timer", "checkpoint"))
+checkpoint_cpu = HistogramFamily("ngl_checkpoint_cpu_seconds", "Process CPU time of a CheckTimer segment.", ("timer", "checkpoint"))
+checkpoint_offcpu = HistogramFamily("ngl_checkpoint_offcpu_seconds", "Wall minus CPU time of a CheckTimer segment (waiting on I/O or the loop).", ("timer", "checkpoint"))
+checkpoint_loop_lag = HistogramFamily("ngl_checkpoint_loop_lag_seconds", "Latest event-loop lag seen when a checkpoint was recorded.", ("timer", "checkpoint"))
+# Event-loop lag, one sample per watchdog tick
+loop_lag = HistogramFamily("ngl_loop_lag_seconds", "Event-loop lag measured by loop_watchdog.", ())
+# Time a request waited in admission.py before it may check out a DB session
+db_checkout_wait = HistogramFamily("ngl_db_checkout_wait_seconds", "Wait for a DB admission slot, by pool and route priority.", ("pool", "priority"))
+
+# One transaction of a background maintenance job (retention, ...)
+background_batch = HistogramFamily("ngl_background_batch_seconds", "Duration of one background job batch.", ("job",))
+
+_families = [checkpoint_wall, checkpoint_cpu, checkpoint_offcpu, checkpoint_loop_lag, loop_lag, db_checkout_wait, background_batch]
+_requests: dict[tuple[str, int], int] = {}
+_gauge_sources: list[tuple[str, callable]] = []
+
+
+def observe_checkpoint(timer: str, checkpoint: str, wall_s: float, cpu_s: float, lag_s: float):
+    key = (timer, checkpoint)
+    checkpoint_wall.get(key).observe(wall_s)
+    checkpoint_cpu.get(key).observe(cpu_s)
+    checkpoint_offcpu.get(key).observe(max(0.0, wall_s - cpu_s))
+    checkpoint_loop_lag.get(key).observe(lag_s)
+
+
+def observe_loop_lag(lag_s: float):
+    loop_lag.get(()).observe(lag_s)
+
+
+def observe_db_checkout_wait(pool: str, priority: str, wait_s: float):
+    db_checkout_wait.get((pool, priority)).observe(wait_s)
+
+
+def observe_background_batch(job: str, seconds: float):
+    background_batch.get((job,)).observe(seconds)
+
+
+def count_request(route: str, status_code: int):
+    key = (route, status_code)
+    if key not in _requests and len(_requests) >= MAX_SERIES:
+        key = ("other", status_code)
+    _requests[key] = _requests.get(key, 0) + 1
+
+
+def register_gauges(prefix: str, source):
+    """Export every numeric value of source() (a stats() dict) as a gauge named prefix_<key>."""
+    _gauge_sources.append((prefix, source))
+
+
+def render() -> str:
+    out: list[str] = []
+    for family in _families:
+        family.render(out)
+
+    out.append("# HELP ngl_http_requests_total Requests handled, by route template and status code.")
+    out.append("# TYPE ngl_http_requests_total counter")
+    for (route, code), n in list(_requests.items()):
+        out.append(f'ngl_http_requests_total{{route="{_escape(route)}",status="{code}"}} {n}')
+
+    for prefix, source in _gauge_sources:
+        for key, value in source().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            out.append(f"# TYPE {prefix}_{key} gauge")
+            out.append(f"{prefix}_{key} {value!r}")
+    out.append("")
+    return "\n".join(out)
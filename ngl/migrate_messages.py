@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Bring an existing messages table up to the current model:
+
+  * messages.time: VARCHAR (ISO strings from datetime.now().isoformat())
+    -> timestamptz. Strings without an offset are read in --legacy-tz
+    (the server's zone when they were written; UTC on Render).
+  * composite (user_id, id DESC) index for inbox listing
+  * partial index on unread rows
+  * drop the single-column user_id index the composite one replaces
+
+Indexes are built CONCURRENTLY so sends keep flowing. The column type change
+rewrites the table under an exclusive lock; run it in a quiet window.
+
+    python -m ngl.migrate_messages [--legacy-tz UTC]
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import text
+
+from .database import engine, column_type
+
+
+async def migrate(legacy_tz: str = "UTC"):
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+
+        if await column_type(conn, "messages", "time") == "character varying":
+            # DDL can't take bind parameters: validate the zone name, then inline it.
+            await conn.execute(text("SELECT now() AT TIME ZONE :tz"), {"tz": legacy_tz})
+            tz_literal = "'" + legacy_tz.replace("'", "''") + "'"
+            print("converting messages.time to timestamptz ...")
+            await conn.execute(text(
+                "ALTER TABLE messages ALTER COLUMN time TYPE timestamptz USING ("
+                "  CASE WHEN time ~ '([+-][0-9]{2}:?[0-9]{2}|Z)$' THEN time::timestamptz"
+                f"       ELSE time::timestamp AT TIME ZONE {tz_literal} END"
+                ")"
+            ))
+            await conn.execute(text("ALTER TABLE messages ALTER COLUMN time SET DEFAULT now()"))
+        else:
+            print("messages.time already migrated")
+
+        print("building ix_messages_user_id_id_desc ...")
+        await conn.execute(text(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_user_id_id_desc ON messages (user_id, id DESC)"
+        ))
+        print("building ix_messages_user_id_unread ...")
+        await conn.execute(text(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_user_id_unread ON messages (user_id) WHERE unread = true"
+        ))
+        print("dropping ix_messages_user_id ...")
+        await conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS ix_messages_user_id"))
+        await conn.execute(text("ANALYZE messages"))
+    print("done")
+
+
+async def main(legacy_tz: str):
+    await migrate(legacy_tz)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--legacy-tz", default="UTC", help="time zone of stored strings that carry no offset")
+    args = parser.parse_args()
+    asyncio.run(main(args.legacy_tz))
@@ -0,0 +1,245 @@
+# notifications.py
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, update, delete, func
+
+from .database import AsyncSessionLocal, NotificationOutbox, User
+from . import admission, user_cache, startup
+
+logger = logging.getLogger("notifications")
+
+DISPATCH_WORKERS = int(os.getenv("FCM_DISPATCH_WORKERS", "4"))
+DISPATCH_BATCH_SIZE = int(os.getenv("FCM_DISPATCH_BATCH_SIZE", "50"))
+DISPATCH_IDLE_SECONDS = float(os.getenv("FCM_DISPATCH_IDLE_SECONDS", "2"))
+MAX_ATTEMPTS = int(os.getenv("FCM_MAX_ATTEMPTS", "6"))
+BACKOFF_BASE_SECONDS = float(os.getenv("FCM_BACKOFF_BASE_SECONDS", "2"))
+BACKOFF_MAX_SECONDS = float(os.getenv("FCM_BACKOFF_MAX_SECONDS", "300"))
+CLAIM_LEASE_SECONDS = float(os.getenv("FCM_CLAIM_LEASE_SECONDS", "60"))
+# Sessions the dispatcher may hold at once. Sends themselves hold none: a
+# batch is claimed in one short transaction and its outcome recorded in
+# another. Half the connections admission reserves; the insert batcher and
+# background jobs share the rest.
+DISPATCH_DB_SESSIONS = int(os.getenv("FCM_DISPATCH_DB_SESSIONS", str(max(1, admission.RESERVED_CONNECTIONS // 2))))
+
+FIREBASE_CREDENTIALS = os.getenv("FIREBASE_CREDENTIALS", "serviceAccountKey.json")
+# FCM_ENDPOINT points messaging at a stand-in FCM server (python -m benchmarks.mock_fcm)
+# so load tests exercise the real send path offline, without Google credentials.
+FCM_ENDPOINT = os.getenv("FCM_ENDPOINT")
+
+# firebase_admin.messaging once _firebase() has run. Importing firebase_admin
+# and loading the service account is kept off the startup path: warm_up()
+# does it in a thread just after the app is ready.
+_messaging = None
+_firebase_lock = threading.Lock()
+# Errors that mean the token will never work again; anything else is retried.
+_DEAD_TOKEN_ERRORS: tuple = ()
+
+_wakeup: asyncio.Event | None = None
+_db_slots: asyncio.Semaphore | None = None
+_workers: list[asyncio.Task] = []
+
+
+def _firebase():
+    global _messaging, _DEAD_TOKEN_ERRORS
+    with _firebase_lock:
+        if _messaging is not None:
+            return _messaging
+        started = time.perf_counter()
+        import firebase_admin as fbad
+        from firebase_admin import messaging
+
+        try:
+            fbad.get_app()
+        except ValueError:
+            if FCM_ENDPOINT:
+                import google.auth.credentials
+
+                class AnonymousCredential(fbad.credentials.Base):
+                    def get_credential(self):
+                        return google.auth.credentials.AnonymousCredentials()
+
+                messaging._MessagingService.FCM_URL = FCM_ENDPOINT.rstrip("/") + "/v1/projects/{0}/messages:send"
+                fbad.initialize_app(AnonymousCredential(), {"projectId": "mock-fcm"})
+                logger.info(f"[firebase] sending notifications to mock FCM at {FCM_ENDPOINT}")
+            else:
+                fbad.initialize_app(fbad.credentials.Certificate(FIREBASE_CREDENTIALS))
+
+        _DEAD_TOKEN_ERRORS = (messaging.UnregisteredError, messaging.SenderIdMismatchError)
+        _messaging = messaging
+        startup.deferred("firebase_init", (time.perf_counter() - started) * 1000)
+        return messaging
+
+
+async def warm_up():
+    """Initialise Firebase in a thread after startup; a bad credentials file is logged here, not at first send."""
+    try:
+        await asyncio.to_thread(_firebase)
+    except Exception:
+        logger.exception("[firebase] initialisation failed; notifications will retry it")
+
+
+def outbox_entry(user_id: str, data: dict) -> NotificationOutbox:
+    """Build an outbox row; the caller adds it to the same session as the Message."""
+    return NotificationOutbox(user_id=user_id, payload=data)
+
+
+def wake_dispatcher():
+    """Nudge idle workers after a commit so delivery doesn't wait for the idle poll."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def _backoff(attempts: int) -> timedelta:
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempts))
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+async def _claim_batch() -> list[tuple[NotificationOutbox, list[str] | None]]:
+    """
+    Lease up to DISPATCH_BATCH_SIZE due rows, with the tokens to send each to.
+    SKIP LOCKED lets several workers (and several processes) drain the table
+    without handing out the same row; pushing next_attempt_at forward acts as
+    a visibility timeout if we crash.
+    """
+    async with _db_slots, AsyncSessionLocal() as db:
+        now = datetime.now(timezone.utc)
+        result = await db.execute(
+            select(NotificationOutbox, User.fcm_tokens)
+            .outerjoin(User, User.id == NotificationOutbox.user_id)
+            .where(NotificationOutbox.next_attempt_at <= now)
+            .order_by(NotificationOutbox.id)
+            .limit(DISPATCH_BATCH_SIZE)
+            .with_for_update(of=NotificationOutbox, skip_locked=True)
+        )
+        rows = [(entry, entry.tokens if entry.tokens is not None else user_tokens) for entry, user_tokens in result.all()]
+        if rows:
+            await db.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.id.in_([entry.id for entry, _ in rows]))
+                .values(next_attempt_at=now + timedelta(seconds=CLAIM_LEASE_SECONDS))
+            )
+            await db.commit()
+        return rows
+
+
+async def _send(entry: NotificationOutbox, tokens: list[str]) -> tuple[list[str], list[str]]:
+    """One FCM round trip, holding no DB connection. Returns (dead tokens, tokens to retry)."""
+    messaging = _messaging or await asyncio.to_thread(_firebase)
+    multicast = messaging.MulticastMessage(
+        data=entry.payload,
+        notification=messaging.Notification(title="New Message"),
+        tokens=tokens
+    )
+    try:
+        response = await messaging.send_each_for_multicast_async(multicast)
+    except Exception as e:
+        logger.warning(f"[outbox] send failed for {entry.user_id} (attempt {entry.attempts + 1}): {e}")
+        return [], tokens
+
+    dead, retry = [], []
+    if response.failure_count > 0:
+        for resp, token in zip(response.responses, tokens):
+            if resp.success:
+                continue
+            if isinstance(resp.exception, _DEAD_TOKEN_ERRORS):
+                dead.append(token)
+            else:
+                retry.append(token)
+    return dead, retry
+
+
+async def _record(outcomes: list[tuple[NotificationOutbox, list[str], list[str]]]):
+    """Prune dead tokens and delete or reschedule the batch's rows, in one short transaction."""
+    async with _db_slots, AsyncSessionLocal() as db:
+        for entry, dead, retry in outcomes:
+            for token in dead:
+                await db.execute(
+                    update(User)
+                    .where(User.id == entry.user_id)
+                    .values(fcm_tokens=func.array_remove(User.fcm_tokens, token))
+                )
+            if retry:
+                await _reschedule(db, entry, retry)
+            else:
+                await db.execute(delete(NotificationOutbox).where(NotificationOutbox.id == entry.id))
+        await db.commit()
+    for entry, dead, _ in outcomes:
+        if dead:
+            user_cache.invalidate(entry.user_id)
+
+
+async def _reschedule(db, entry: NotificationOutbox, tokens: list[str]):
+    attempts = entry.attempts + 1
+    if attempts >= MAX_ATTEMPTS:
+        logger.warning(f"[outbox] giving up on notification {entry.id} for {entry.user_id} after {attempts} attempts")
+        await db.execute(delete(NotificationOutbox).where(NotificationOutbox.id == entry.id))
+    else:
+        await db.execute(
+            update(NotificationOutbox)
+            .where(NotificationOutbox.id == entry.id)
+            .values(
+                attempts=attempts,
+                tokens=tokens,
+                next_attempt_at=datetime.now(timezone.utc) + _backoff(attempts),
+            )
+        )
+
+
+async def _dispatch(batch: list[tuple[NotificationOutbox, list[str] | None]]):
+    # Rows whose user has no tokens (or is gone) are simply dropped
+    outcomes = [(entry, [], []) for entry, tokens in batch if not tokens]
+    sending = [(entry, tokens) for entry, tokens in batch if tokens]
+    results = await asyncio.gather(*(_send(entry, tokens) for entry, tokens in sending), return_exceptions=True)
+    for (entry, tokens), result in zip(sending, results):
+        if isinstance(result, Exception):
+            logger.warning(f"[outbox] delivery of {entry.id} raised: {result}")
+            result = ([], tokens)
+        outcomes.append((entry, *result))
+    await _record(outcomes)
+
+
+async def _worker(n: int):
+    while True:
+        # Clear before claiming so a wake-up that races with the claim isn't lost.
+        _wakeup.clear()
+        try:
+            batch = await _claim_batch()
+            if batch:
+                await _dispatch(batch)
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Unrecorded rows are retried once their lease runs out
+            logger.warning(f"[outbox] worker {n} failed: {e}")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=DISPATCH_IDLE_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_dispatcher():
+    global _wakeup, _db_slots
+    if _workers:
+        return
+    _wakeup = asyncio.Event()
+    _db_slots = asyncio.Semaphore(DISPATCH_DB_SESSIONS)
+    loop = asyncio.get_running_loop()
+    for n in range(DISPATCH_WORKERS):
+        _workers.append(loop.create_task(_worker(n)))
+    _workers.append(loop.create_task(warm_up()))
+    logger.info(f"[outbox] dispatcher started with {DISPATCH_WORKERS} workers")
+
+
+async def stop_dispatcher():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
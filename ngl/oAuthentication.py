@@ -1,11 +1,14 @@
 from datetime import datetime, timedelta, timezone
 from jose import jwt, JWTError
 from . import schema
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, status, Depends, Request
 from fastapi.security import OAuth2PasswordBearer
 
 import dotenv
+import hmac
 import os
+import time
+from collections import OrderedDict
 dotenv.load_dotenv()
 
 SECRET_KEY = str(os.getenv("SECRET_KEY"))
@@ -34,17 +37,58 @@ async def create_refresh_token(data : dict):
     jwt_token = jwt.encode(to_encode, REFRESH_TOKEN_SECRET_KEY, algorithm=ALGORITHM)
     return jwt_token
 
+# Verified-token cache: (secret, raw token) -> (exp, UserID). Shared by access
+# and refresh tokens; an entry is never trusted past the token's own exp, so a
+# hit is as good as a fresh jwt.decode.
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "4096"))
+_jwt_cache: "OrderedDict[tuple[str, str], tuple[float, schema.UserID]]" = OrderedDict()
+_jwt_cache_hits = 0
+_jwt_cache_misses = 0
+_jwt_decode_ns = 0  # total time spent in jwt.decode, to estimate what hits save
+
+def jwt_cache_stats():
+    decoded = _jwt_cache_misses or 1
+    avg_decode_us = _jwt_decode_ns / decoded / 1000
+    return {
+        "size": len(_jwt_cache),
+        "max_size": JWT_CACHE_SIZE,
+        "hits": _jwt_cache_hits,
+        "misses": _jwt_cache_misses,
+        "avg_decode_us": round(avg_decode_us, 1),
+        "estimated_saved_ms": round(_jwt_cache_hits * avg_decode_us / 1000, 1),
+    }
+
 async def verify_jwt(token: str, exception: HTTPException, secret_key : str = SECRET_KEY):
+    global _jwt_cache_hits, _jwt_cache_misses, _jwt_decode_ns
+    key = (secret_key, token)
+    cached = _jwt_cache.get(key)
+    if cached is not None:
+        if cached[0] > time.time():
+            _jwt_cache.move_to_end(key)
+            _jwt_cache_hits += 1
+            return cached[1]
+        del _jwt_cache[key]
+
+    _jwt_cache_misses += 1
+    started = time.perf_counter_ns()
     try:
         payload = jwt.decode(token, secret_key, algorithms=[ALGORITHM])
         if not payload.get("id"):
             print("here1")
             raise exception
-        return schema.UserID(id=payload['id'])
+        user = schema.UserID(id=payload['id'])
     except JWTError as e:
         print("here2")
         print("JWT verification failed with error: \n", e)
         raise exception
+    finally:
+        _jwt_decode_ns += time.perf_counter_ns() - started
+
+    if exp := payload.get("exp"):
+        _jwt_cache[key] = (float(exp), user)
+        while len(_jwt_cache) > JWT_CACHE_SIZE:
+            _jwt_cache.popitem(last=False)
+    return user
     
 password_bearer = OAuth2PasswordBearer(tokenUrl="/authentication/login")
 
@@ -56,6 +100,46 @@ async def get_current_user(token: dict = Depends(password_bearer)):
 
     return await verify_jwt(token, exception)
 
+password_bearer_optional = OAuth2PasswordBearer(tokenUrl="/authentication/login", auto_error=False)
+
+async def get_stream_user(token: str | None = Depends(password_bearer_optional), access_token: str | None = None):
+    """
+    Same as get_current_user, but also accepts ?access_token= because
+    EventSource/WebSocket clients in the browser cannot set headers.
+    """
+    exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials"
+    )
+    if not (token := token or access_token):
+        raise exception
+    return await verify_jwt(token, exception)
+
+# Comma-separated user ids allowed to call /admin endpoints; empty means nobody.
+ADMIN_USER_IDS = {u.strip().lower() for u in os.getenv("ADMIN_USER_IDS", "").split(",") if u.strip()}
+
+async def get_admin_user(current_user: schema.UserID = Depends(get_current_user)):
+    if current_user.id.lower() not in ADMIN_USER_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return current_user
+
+# Static bearer token for a Prometheus scraper on /admin/metrics, which can't
+# refresh JWTs; admins' access tokens are accepted there too.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+async def get_metrics_reader(token: str | None = Depends(password_bearer_optional)):
+    if METRICS_TOKEN and token and hmac.compare_digest(token, METRICS_TOKEN):
+        return None
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials"
+        )
+    return await get_admin_user(await get_current_user(token))
+
 def decode_jwt(token: str, secret_key: str = SECRET_KEY, algorithms: list = [ALGORITHM]):
     try:
         payload = jwt.decode(token, secret_key, algorithms=algorithms)
@@ -0,0 +1,134 @@
+# rate_limit.py
+import math
+import os
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException, Request, status
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "True") == "True"
+SEND_IP_PER_MINUTE = float(os.getenv("SEND_IP_PER_MINUTE", "30"))
+SEND_IP_BURST = float(os.getenv("SEND_IP_BURST", "10"))
+SEND_RECIPIENT_PER_MINUTE = float(os.getenv("SEND_RECIPIENT_PER_MINUTE", "120"))
+SEND_RECIPIENT_BURST = float(os.getenv("SEND_RECIPIENT_BURST", "30"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# The limits above are for the whole service. Under ngl.serve every worker
+# keeps its own buckets and the kernel spreads requests across them, so each
+# enforces a 1/RATE_LIMIT_WORKERS share (serve.py sets it to the worker count).
+RATE_LIMIT_WORKERS = max(1, int(os.getenv("RATE_LIMIT_WORKERS", "1")))
+# How many proxies (Render's load balancer, ...) append to X-Forwarded-For.
+# The client address is the entry that many places from the right; anything
+# further left was supplied by the client and can't be trusted for limiting.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+
+
+def client_ip(request: Request) -> str:
+    x_forwarded_for = request.headers.get("X-Forwarded-For")
+    if x_forwarded_for and TRUSTED_PROXY_HOPS > 0:
+        hops = [h.strip() for h in x_forwarded_for.split(",") if h.strip()]
+        if hops:
+            return hops[max(0, len(hops) - TRUSTED_PROXY_HOPS)]
+    return request.client.host if request.client else "unknown"
+
+
+class TokenBucketLimiter:
+    """
+    One token bucket per key, in an OrderedDict kept in last-touched order.
+    A bucket left alone for burst/rate seconds is full again, i.e. the same
+    as no bucket, so expiry is just popping from the old end until the first
+    recent entry: O(1) amortised, no timers, no background task. The size
+    cap evicts the same way (the oldest bucket is the one closest to full).
+    """
+
+    def __init__(self, per_minute: float, burst: float, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self.idle_expiry = burst / self.rate if self.rate > 0 else float("inf")
+        self._buckets: "OrderedDict[str, list[float]]" = OrderedDict()  # key -> [tokens, last_ts]
+        self.rejected = 0
+
+    def _expire(self, now: float):
+        buckets = self._buckets
+        while buckets:
+            key, (_, last) = next(iter(buckets.items()))
+            if now - last < self.idle_expiry and len(buckets) <= self.max_keys:
+                break
+            buckets.popitem(last=False)
+
+    def wait_time(self, key: str, now: float) -> float:
+        """Seconds until key has a whole token (0.0 if it has one now). Does not consume."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return 0.0
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        if tokens >= 1.0:
+            return 0.0
+        return (1.0 - tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def consume(self, key: str, now: float):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+        bucket[0] -= 1.0
+        self._expire(now)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+def _worker_share(per_minute: float, burst: float) -> tuple[float, float]:
+    # A bucket needs at least one whole token to ever admit anything
+    return per_minute / RATE_LIMIT_WORKERS, max(1.0, burst / RATE_LIMIT_WORKERS)
+
+
+send_by_ip = TokenBucketLimiter(*_worker_share(SEND_IP_PER_MINUTE, SEND_IP_BURST))
+send_by_recipient = TokenBucketLimiter(*_worker_share(SEND_RECIPIENT_PER_MINUTE, SEND_RECIPIENT_BURST))
+_allowed = 0
+
+
+async def limit_send(user_id: str, request: Request):
+    """
+    Dependency for POST /sending/{user_id}. Runs before get_db, so a rejected
+    request never touches the connection pool. A request only spends tokens
+    if both buckets admit it.
+    """
+    global _allowed
+    if not RATE_LIMIT_ENABLED:
+        return
+    now = time.monotonic()
+    ip = client_ip(request)
+    recipient = user_id.lower()
+
+    wait = send_by_ip.wait_time(ip, now)
+    limiter = send_by_ip
+    if not wait:
+        wait = send_by_recipient.wait_time(recipient, now)
+        limiter = send_by_recipient
+    if wait:
+        limiter.rejected += 1
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many messages, slow down",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
+
+    send_by_ip.consume(ip, now)
+    send_by_recipient.consume(recipient, now)
+    _allowed += 1
+
+
+def stats() -> dict:
+    return {
+        "enabled": RATE_LIMIT_ENABLED,
+        "workers": RATE_LIMIT_WORKERS,
+        "allowed": _allowed,
+        "rejected_ip": send_by_ip.rejected,
+        "rejected_recipient": send_by_recipient.rejected,
+        "tracked_ips": len(send_by_ip),
+        "tracked_recipients": len(send_by_recipient),
+    }
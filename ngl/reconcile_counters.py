@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+One-shot backfill / reconcile for User.message_count and User.unread_count.
+
+Adds the counter columns (and inbox_version) if this database predates
+them, then recomputes both
+counters from the messages table in small batches of users so no single
+transaction holds many row locks.
+
+    python -m ngl.reconcile_counters [--batch-size 500]
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import select, update, func, text
+
+from .database import AsyncSessionLocal, engine, User, Message
+
+
+async def ensure_columns():
+    async with engine.begin() as conn:
+        await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS message_count INTEGER NOT NULL DEFAULT 0"))
+        await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS unread_count INTEGER NOT NULL DEFAULT 0"))
+        await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS inbox_version BIGINT NOT NULL DEFAULT 0"))
+
+
+async def reconcile(batch_size: int = 500) -> int:
+    """Recompute counters for every user. Returns the number of users whose counters were wrong."""
+    fixed = 0
+    last_id = ""
+    while True:
+        async with AsyncSessionLocal() as db:
+            ids = (await db.scalars(
+                select(User.id).where(User.id > last_id).order_by(User.id).limit(batch_size)
+            )).all()
+            if not ids:
+                return fixed
+            last_id = ids[-1]
+
+            # Lock the batch first so concurrent sends wait instead of racing the recount.
+            current = {
+                row.id: (row.message_count, row.unread_count, row.inbox_version)
+                for row in await db.execute(
+                    select(User.id, User.message_count, User.unread_count, User.inbox_version)
+                    .where(User.id.in_(ids))
+                    .order_by(User.id)
+                    .with_for_update()
+                )
+            }
+            actual = {
+                row.user_id: (row.total, row.unread)
+                for row in await db.execute(
+                    select(
+                        Message.user_id,
+                        func.count().label("total"),
+                        func.count().filter(Message.unread == True).label("unread"),
+                    )
+                    .where(Message.user_id.in_(ids))
+                    .group_by(Message.user_id)
+                )
+            }
+            changes = []
+            for user_id, (message_count, unread_count, inbox_version) in current.items():
+                total, unread = actual.get(user_id, (0, 0))
+                if (message_count, unread_count) != (total, unread):
+                    changes.append({"id": user_id, "message_count": total, "unread_count": unread, "inbox_version": inbox_version + 1})
+            if changes:
+                await db.execute(update(User), changes)
+            await db.commit()
+            fixed += len(changes)
+            print(f"reconciled users up to {last_id!r}: {len(changes)} corrected")
+
+
+async def main(batch_size: int):
+    await ensure_columns()
+    fixed = await reconcile(batch_size)
+    print(f"done, {fixed} users corrected")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size))
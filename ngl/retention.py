@@ -0,0 +1,273 @@
+# retention.py
+"""
+Message retention: prune messages older than RETENTION_MAX_AGE_DAYS and
+everything past each user's newest RETENTION_MAX_MESSAGES_PER_USER, copying
+them to messages_archive first when RETENTION_ARCHIVE=True.
+
+With RETENTION_ENABLED=True a background task runs a pass every
+RETENTION_INTERVAL_SECONDS. A single pass can also be run by hand:
+
+    python -m ngl.retention [--max-age-days 365] [--max-messages-per-user 5000] [--archive]
+
+A pass is a series of small transactions (at most RETENTION_BATCH_SIZE rows,
+RETENTION_BATCH_PAUSE_MS apart). Each one
+  * takes a transaction advisory lock, so across workers only one batch runs
+    at a time; a worker that finds it taken leaves the pass to the holder
+  * sets a short lock_timeout, so it gives way to sends and inbox updates on
+    the same rows instead of queueing behind them
+  * deletes (and archives) with one statement and adjusts the owners' inbox
+    counters in the same transaction, as delete_message does.
+
+Age pruning walks the oldest ids and stops at the first window with fewer
+than a batch of expired rows: message ids are assigned in time order, so
+this never scans the live end of the table.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, text
+from sqlalchemy.exc import DBAPIError
+
+from .database import AsyncSessionLocal, User
+from . import counters, metrics
+
+logger = logging.getLogger("retention")
+
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "False") == "True"
+MAX_AGE_DAYS = float(os.getenv("RETENTION_MAX_AGE_DAYS", "0"))  # 0: no age limit
+MAX_MESSAGES_PER_USER = int(os.getenv("RETENTION_MAX_MESSAGES_PER_USER", "0"))  # 0: no per-user limit
+ARCHIVE = os.getenv("RETENTION_ARCHIVE", "False") == "True"
+BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+BATCH_PAUSE_MS = float(os.getenv("RETENTION_BATCH_PAUSE_MS", "200"))
+INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+LOCK_TIMEOUT_MS = int(os.getenv("RETENTION_LOCK_TIMEOUT_MS", "500"))
+
+_LOCK_NOT_AVAILABLE = "55P03"
+
+# Victim selections, spliced into _prune_statement()
+_EXPIRED = """
+    SELECT id FROM (SELECT id, time FROM messages ORDER BY id LIMIT :batch) oldest
+    WHERE time < :cutoff
+"""
+_OVER_LIMIT = """
+    SELECT excess.id
+    FROM unnest(CAST(:user_ids AS varchar[]), CAST(:counts AS integer[])) AS u(user_id, n)
+    CROSS JOIN LATERAL (
+        SELECT id FROM messages WHERE messages.user_id = u.user_id
+        ORDER BY id DESC OFFSET :keep LIMIT u.n
+    ) excess
+"""
+
+_task: asyncio.Task | None = None
+_last_run: dict = {}
+_totals = {"runs": 0, "pruned": 0, "archived": 0, "batches": 0, "lock_timeouts": 0}
+
+
+class _Yield(Exception):
+    """Another worker holds the retention lock."""
+
+
+def _prune_statement(victims: str, archive: bool):
+    if archive:
+        returning = "id, user_id, content, time, unread"
+        archive_cte = """,
+        archived AS (
+            INSERT INTO messages_archive (id, user_id, content, time)
+            SELECT id, user_id, content, time FROM pruned
+            ON CONFLICT (id) DO NOTHING
+        )"""
+    else:
+        returning, archive_cte = "user_id, unread", ""
+    return text(f"""
+        WITH pruned AS (
+            DELETE FROM messages WHERE id IN ({victims})
+            RETURNING {returning}
+        ){archive_cte}
+        SELECT user_id, count(*) AS messages, count(*) FILTER (WHERE unread) AS unread
+        FROM pruned GROUP BY user_id
+    """)
+
+
+async def _prune_batch(run: dict, victims: str, params: dict, archive: bool) -> int:
+    """One transaction; returns rows pruned (0 if it gave way to a lock). Raises _Yield."""
+    started = time.perf_counter()
+    try:
+        async with AsyncSessionLocal() as db:
+            if not await db.scalar(text("SELECT pg_try_advisory_xact_lock(hashtext('ngl.retention'))")):
+                raise _Yield()
+            await db.execute(text(f"SET LOCAL lock_timeout = {LOCK_TIMEOUT_MS}"))
+            rows = (await db.execute(_prune_statement(victims, archive), params)).all()
+            await counters.bump_many(db, {r.user_id: (-r.messages, -r.unread) for r in rows})
+            await db.commit()
+    except DBAPIError as e:
+        if getattr(e.orig, "sqlstate", None) != _LOCK_NOT_AVAILABLE:
+            raise
+        run["lock_timeouts"] += 1
+        rows = []
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    metrics.observe_background_batch("retention", elapsed_ms / 1000)
+
+    pruned = sum(r.messages for r in rows)
+    run["batches"] += 1
+    run["batch_ms_total"] += elapsed_ms
+    run["batch_ms_max"] = max(run["batch_ms_max"], elapsed_ms)
+    if archive:
+        run["archived"] += pruned
+    await asyncio.sleep(BATCH_PAUSE_MS / 1000.0)
+    return pruned
+
+
+async def _prune_expired(run: dict, max_age_days: float, archive: bool):
+    cutoff = datetime.now(timezone.utc) - timedelta(days=max_age_days)
+    while True:
+        pruned = await _prune_batch(run, _EXPIRED, {"batch": BATCH_SIZE, "cutoff": cutoff}, archive)
+        run["pruned_age"] += pruned
+        if pruned < BATCH_SIZE:
+            return
+
+
+async def _prune_over_limit(run: dict, keep: int, archive: bool):
+    # message_count only nominates users; what is deleted is decided by OFFSET
+    # :keep on the live rows, so a drifted counter can never cut below the limit.
+    last_id = ""
+    while True:
+        async with AsyncSessionLocal() as db:
+            over = (await db.execute(
+                select(User.id, User.message_count)
+                .where(User.message_count > keep, User.id > last_id)
+                .order_by(User.id)
+                .limit(BATCH_SIZE)
+            )).all()
+        if not over:
+            return
+        last_id = over[-1].id
+
+        group: list[tuple[str, int]] = []
+        for user_id, message_count in over:
+            excess = message_count - keep
+            if excess >= BATCH_SIZE:
+                # A big backlog gets batches of its own until it is under the limit
+                while excess > 0:
+                    pruned = await _prune_over_limit_batch(run, [(user_id, min(excess, BATCH_SIZE))], keep, archive)
+                    if not pruned:
+                        break
+                    excess -= pruned
+                continue
+            if sum(n for _, n in group) + excess > BATCH_SIZE:
+                await _prune_over_limit_batch(run, group, keep, archive)
+                group = []
+            group.append((user_id, excess))
+        if group:
+            await _prune_over_limit_batch(run, group, keep, archive)
+
+
+async def _prune_over_limit_batch(run: dict, group: list[tuple[str, int]], keep: int, archive: bool) -> int:
+    params = {"user_ids": [u for u, _ in group], "counts": [n for _, n in group], "keep": keep}
+    pruned = await _prune_batch(run, _OVER_LIMIT, params, archive)
+    run["pruned_excess"] += pruned
+    return pruned
+
+
+async def run_once(max_age_days: float = MAX_AGE_DAYS, max_messages_per_user: int = MAX_MESSAGES_PER_USER,
+                   archive: bool = ARCHIVE) -> dict:
+    """One retention pass. Returns (and keeps, for stats()) the per-run report."""
+    global _last_run
+    run = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "pruned_age": 0, "pruned_excess": 0, "archived": 0,
+        "batches": 0, "batch_ms_total": 0.0, "batch_ms_max": 0.0, "lock_timeouts": 0,
+        "yielded": False,
+    }
+    started = time.perf_counter()
+    try:
+        if max_age_days > 0:
+            await _prune_expired(run, max_age_days, archive)
+        if max_messages_per_user > 0:
+            await _prune_over_limit(run, max_messages_per_user, archive)
+    except _Yield:
+        run["yielded"] = True
+    run["duration_s"] = round(time.perf_counter() - started, 3)
+    batch_ms_total = run.pop("batch_ms_total")
+    run["batch_ms_avg"] = round(batch_ms_total / run["batches"], 1) if run["batches"] else 0.0
+    run["batch_ms_max"] = round(run["batch_ms_max"], 1)
+
+    pruned = run["pruned_age"] + run["pruned_excess"]
+    _totals["runs"] += 1
+    _totals["pruned"] += pruned
+    _totals["archived"] += run["archived"]
+    _totals["batches"] += run["batches"]
+    _totals["lock_timeouts"] += run["lock_timeouts"]
+    _last_run = run
+    if pruned or run["lock_timeouts"] or run["yielded"]:
+        logger.info(
+            f"[retention] pruned {pruned} ({run['pruned_age']} expired, {run['pruned_excess']} over limit, "
+            f"{run['archived']} archived) in {run['batches']} batches, batch avg {run['batch_ms_avg']}ms "
+            f"max {run['batch_ms_max']}ms, {run['lock_timeouts']} lock timeouts, "
+            f"{'yielded to another worker, ' if run['yielded'] else ''}took {run['duration_s']}s"
+        )
+    return run
+
+
+async def _run():
+    # Off the startup path, and workers that booted together don't all start at once
+    await asyncio.sleep(random.uniform(0.1, 1.0) * min(INTERVAL_SECONDS, 300))
+    while True:
+        try:
+            await run_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("[retention] pass failed")
+        await asyncio.sleep(INTERVAL_SECONDS)
+
+
+def start():
+    global _task
+    if _task is not None:
+        return
+    if MAX_AGE_DAYS <= 0 and MAX_MESSAGES_PER_USER <= 0:
+        logger.warning("[retention] enabled but neither RETENTION_MAX_AGE_DAYS nor RETENTION_MAX_MESSAGES_PER_USER is set")
+        return
+    _task = asyncio.get_running_loop().create_task(_run())
+    logger.info(
+        f"[retention] every {INTERVAL_SECONDS:.0f}s: max_age_days={MAX_AGE_DAYS or 'off'}, "
+        f"max_messages_per_user={MAX_MESSAGES_PER_USER or 'off'}, archive={ARCHIVE}"
+    )
+
+
+async def stop():
+    """Cancels a pass between (or during) batches; the open batch's transaction rolls back."""
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    await asyncio.gather(_task, return_exceptions=True)
+    _task = None
+
+
+def stats() -> dict:
+    return {
+        "enabled": RETENTION_ENABLED,
+        **{f"total_{k}": v for k, v in _totals.items()},
+        **{f"last_{k}": v for k, v in _last_run.items()},
+    }
+
+
+async def main(max_age_days: float, max_messages_per_user: int, archive: bool):
+    from .database import engine
+    print(await run_once(max_age_days, max_messages_per_user, archive))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-age-days", type=float, default=MAX_AGE_DAYS)
+    parser.add_argument("--max-messages-per-user", type=int, default=MAX_MESSAGES_PER_USER)
+    parser.add_argument("--archive", action="store_true", default=ARCHIVE)
+    args = parser.parse_args()
+    asyncio.run(main(args.max_age_days, args.max_messages_per_user, args.archive))
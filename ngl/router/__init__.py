@@ -1 +1 @@
-from . import authentication, receiving, sending
\ No newline at end of file
+from . import admin, authentication, receiving, sending
\ No newline at end of file
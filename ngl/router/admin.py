@@ -0,0 +1,83 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from .. import schema, oAuthentication, diagnostics, metrics, startup, user_cache, hashing, inbox_stream, rate_limit, retention, account_deletion, admission
+from ..database import db_pool_stats, read_routing_stats
+from ..loop_watchdog import get_stall_report
+from ..timer import recent_slow_traces
+
+router = APIRouter(
+    prefix="/admin",
+    tags=['Admin']
+)
+
+@router.get("/diagnostics", status_code=status.HTTP_200_OK)
+async def get_diagnostics(current_user: schema.UserID = Depends(oAuthentication.get_admin_user)):
+    return diagnostics.current_profile()
+
+@router.put("/diagnostics", status_code=status.HTTP_200_OK)
+async def set_diagnostics(request: schema.DiagnosticsUpdate, current_user: schema.UserID = Depends(oAuthentication.get_admin_user)):
+    overrides = request.model_dump(exclude={"level"}, exclude_none=True)
+    try:
+        return await diagnostics.update(request.level, **overrides)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+# Operational endpoints, admins only. Kept off the root, where each would
+# shadow the /{user_id} send page of a user with the same id.
+
+@router.get("/user-cache-stats", status_code=status.HTTP_200_OK)
+async def get_user_cache_stats(current_user: schema.UserID = Depends(oAuthentication.get_admin_user)):
+    return user_cache.stats()
+
+@router.get("/hash-queue-stats", status_code=status.HTTP_200_OK)
+async def get_hash_queue_stats(current_user: schema.UserID = Depends(oAuthentication.get_admin_user)):
+    return hashing.stats()
+
+@router.get("/jwt-cache-stats", status_code=status.HTTP_200_OK)
+async def get_jwt_cache_stats(current_user: schema.UserID = Depends(oAuthentication.get_admin_user)):
+    return oAuthentication.jwt_cache_stats()
+
+@router.get("/stream-stats", status_code=status.HTTP_200_OK)
+async def get_stream_stats(current_user: schema.UserID = Depends(oAuthentication.get_admin_user)):
+    return inbox_stream.stats()
+
+@router.get("/rate-limit-stats", status_code=status.HTTP_200_OK)
+async def get_rate_limit_stats(current_user: schema.UserID = Depends(oAuthentication.get_admin_user)):
+    return rate_limit.stats()
+
+@router.get("/retention-stats", status_code=status.HTTP_200_OK)
+async def get_retention_stats(current_user: schema.UserID = Depends(oAuthentication.get_admin_user)):
+    return retention.stats()
+
+@router.get("/account-deletion-stats", status_code=status.HTTP_200_OK)
+async def get_account_deletion_stats(current_user: schema.UserID = Depends(oAuthentication.get_admin_user)):
+    return account_deletion.stats()
+
+@router.get("/db-admission-stats", status_code=status.HTTP_200_OK)
+async def get_db_admission_stats(current_user: schema.UserID = Depends(oAuthentication.get_admin_user)):
+    return {
+        **admission.stats(),
+        "pool": db_pool_stats(),
+        "replica": admission.stats("replica"),
+        "read_routing": read_routing_stats(),
+    }
+
+@router.get("/startup-stats", status_code=status.HTTP_200_OK)
+async def get_startup_stats(current_user: schema.UserID = Depends(oAuthentication.get_admin_user)):
+    return startup.report()
+
+@router.get("/slow-traces", status_code=status.HTTP_200_OK)
+async def get_slow_traces(current_user: schema.UserID = Depends(oAuthentication.get_admin_user)):
+    return recent_slow_traces()
+
+@router.get("/loop-stalls", status_code=status.HTTP_200_OK)
+async def get_loop_stalls(current_user: schema.UserID = Depends(oAuthentication.get_admin_user)):
+    return get_stall_report()
+
+@router.get("/metrics", status_code=status.HTTP_200_OK)
+async def get_metrics(reader: None = Depends(oAuthentication.get_metrics_reader)):
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
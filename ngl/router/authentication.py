@@ -3,9 +3,8 @@ from fastapi import APIRouter, Depends, HTTPException, status, Response, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.responses import RedirectResponse, FileResponse
 from ..database import *
-from .. import schema, oAuthentication
+from .. import schema, oAuthentication, user_cache, account_deletion, admission
 from ..hashing import Hash
-from authlib.integrations.starlette_client import OAuth, OAuthError
 from fastapi.templating import Jinja2Templates
 import dotenv
 import warnings
@@ -19,20 +18,36 @@ router = APIRouter(
     tags = ["Authentication"]
 )
 
-oauth = OAuth()
-oauth.register(
-    name="google",
-    server_metadata_url="https://accounts.google.com/.well-known/openid-configuration",
-    client_id=os.getenv("GOOGLE_CLIENT_ID"),
-    client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
-    client_kwargs={
-        "scope": "openid email profile",
-        # You can add "prompt": "consent" here during dev if you want to re-prompt each time
-    },
-)
+_oauth = None
+
+def google_oauth():
+    """The Google OAuth client, built on first use: authlib (and httpx under it) is ~150 ms of import we don't pay at boot."""
+    global _oauth
+    if _oauth is None:
+        from authlib.integrations.starlette_client import OAuth
+        _oauth = OAuth()
+        _oauth.register(
+            name="google",
+            server_metadata_url="https://accounts.google.com/.well-known/openid-configuration",
+            client_id=os.getenv("GOOGLE_CLIENT_ID"),
+            client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
+            client_kwargs={
+                "scope": "openid email profile",
+                # You can add "prompt": "consent" here during dev if you want to re-prompt each time
+            },
+        )
+    return _oauth.google
 
 templates = Jinja2Templates(directory="pages")
 
+# First path segments the app serves itself; a user with one of these ids
+# would have their /{user_id} send page shadowed by it.
+RESERVED_USER_IDS = {
+    "admin", "authentication", "sending", "recieving",
+    "health", "memory-usages", "ads.txt",
+    "sobaibolo-docs", "sobaibolo-redoc", "sobaibolo-openapi.json",
+}
+
 
 async def set_refresh_token(resp: Response, data: dict):
     token = await oAuthentication.create_refresh_token(data)
@@ -70,45 +85,62 @@ async def send_login(user_id, resp: Response = None, status_code: int = status.H
 
 async def generate_user_id(email: str, db: AsyncSession = Depends(get_db)) -> str:
     base_id = email.split('@')[0]
-    while await db.get(User, base_id):
+    while base_id.lower() in RESERVED_USER_IDS or await db.get(User, base_id):
         base_id += "." + str(int.from_bytes(os.urandom(2), 'big'))
     
     return base_id
 
 @router.post('/signup', status_code=status.HTTP_201_CREATED)
-async def create_user(request: schema.Signup, response: Response, db: AsyncSession = Depends(get_db)):
+async def create_user(request: schema.Signup, response: Response, http_request: Request, db: AsyncSession = Depends(get_db)):
+    if request.id.lower() in RESERVED_USER_IDS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User id is reserved')
+    # bcrypt is the slow part; don't hold a DB slot through it
+    admission.release_early(http_request)
+    password = await Hash.bcrypt_async(request.password)
+    await admission.readmit(http_request)
     if await db.get(User, request.id.lower()):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User id already exists')
     if request.email and request.email.strip() == "":
         request.email = None
     if request.name and request.name.strip() == "":
         request.name = None
-    user = User(id=request.id.lower(), name=request.name, password=Hash.bcrypt(request.password), email=request.email, fcm_tokens = [request.fcm_token] if request.fcm_token else None)
+    user = User(id=request.id.lower(), name=request.name, password=password, email=request.email, fcm_tokens = [request.fcm_token] if request.fcm_token else None)
     db.add(user)
     await db.commit()
+    user_cache.invalidate(user.id)
     # await db.refresh(user)
     return await send_login(request.id, response, status_code=status.HTTP_201_CREATED)
 
 
 @router.patch('/login', status_code=status.HTTP_202_ACCEPTED)
-async def login(resp : Response, request: schema.Login , db: AsyncSession = Depends(get_db)):
+async def login(resp : Response, request: schema.Login , http_request: Request, db: AsyncSession = Depends(get_db)):
     print("Login called")
     user = await db.get(User, request.user_id.lower())
-    if not user or not Hash.verify(request.password, user.password):
+    if not user or user.deleted_at is not None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid credentials')
+    # Hand the connection and DB slot back while bcrypt runs
+    await db.close()
+    admission.release_early(http_request)
+    if not await Hash.verify_async(request.password, user.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid credentials')
     
     payload = await send_login(user.id, resp)
     payload["username"] = user.name
     if fcm_token := request.fcm_token:
+        await admission.readmit(http_request)
+        user = await db.get(User, user.id)
+        if user is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid credentials')
         if user.fcm_tokens is None:
             user.fcm_tokens = [fcm_token]
         elif fcm_token not in user.fcm_tokens:
             user.fcm_tokens = user.fcm_tokens + [fcm_token]
         await db.commit()
+        user_cache.invalidate(user.id)
     return payload
 
 @router.post('/refresh', status_code=status.HTTP_200_OK)
-async def refresh_token(resp: Response, request: Request, body: schema.RefreshToken, db: AsyncSession = Depends(get_db)):
+async def refresh_token(resp: Response, request: Request, body: schema.RefreshToken, db: AsyncSession = Depends(get_read_db)):
     exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail='Invalid credentials'
@@ -122,7 +154,7 @@ async def refresh_token(resp: Response, request: Request, body: schema.RefreshTo
 
     payload = await oAuthentication.verify_jwt(token, exception, secret_key=oAuthentication.REFRESH_TOKEN_SECRET_KEY)
 
-    user = await db.get(User, payload.id.lower())
+    user = await user_cache.get_user(db, payload.id.lower())
     if not user:
         print("Refresh token user not found")
         raise exception
@@ -144,15 +176,16 @@ async def refresh_token(resp: Response, request: Request, body: schema.RefreshTo
 # @router.get("/login/google")
 # async def google_login(request: Request):
 #     redirect_uri = request.url_for("google_auth")
-#     return await oauth.google.authorize_redirect(request, redirect_uri)
+#     return await google_oauth().authorize_redirect(request, redirect_uri)
 
 # @router.get("/callback/google")
 # async def google_auth(request: Request, resp: Response, db: AsyncSession = Depends(get_db)):
+#     from authlib.integrations.starlette_client import OAuthError
 #     try:
-#         token = await oauth.google.authorize_access_token(request)
+#         token = await google_oauth().authorize_access_token(request)
 #         userinfo = token.get("userinfo")
 #         if not userinfo:
-#             userinfo = await oauth.google.parse_id_token(request, token)
+#             userinfo = await google_oauth().parse_id_token(request, token)
 #         if not userinfo:
 #             raise HTTPException(status_code=400, detail="Failed to obtain user info")
 #         print("Google user info:", userinfo)
@@ -259,8 +292,8 @@ async def refresh_token(resp: Response, request: Request, body: schema.RefreshTo
 #     return await send_login(user.id, resp)
 
 
-@router.delete('/delete_account', status_code=status.HTTP_202_ACCEPTED)
-async def delete_account(body : schema.Login, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+@router.delete('/delete_account', status_code=status.HTTP_202_ACCEPTED, response_model=schema.AccountDeletionStatus)
+async def delete_account(body : schema.Login, request: Request, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     if not current_user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     
@@ -272,13 +305,33 @@ async def delete_account(body : schema.Login, current_user: User = Depends(get_c
     if not current_user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Id doesn't exists")
     
-    if not Hash.verify(body.password, current_user.password):
+    # Hand the connection and DB slot back while bcrypt runs
+    await db.close()
+    admission.release_early(request)
+    if not await Hash.verify_async(body.password, current_user.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     
-    await db.delete(current_user)
-    await db.commit() ## TODO: delete messages too
+    await admission.readmit(request)
+    current_user = await db.get(User, current_user.id)
+    if not current_user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Id doesn't exists")
+    
+    # Refused everywhere from this commit on; messages, Google link and the
+    # user row are removed in chunks by account_deletion.py
+    if current_user.deleted_at is None:
+        await account_deletion.request(db, current_user)
+        await db.commit()
+        user_cache.invalidate(current_user.id)
+        account_deletion.wake()
 
-    return {"detail": "User deleted"}
+    return await account_deletion.progress(db, current_user.id)
+
+@router.get('/delete_account/status', status_code=status.HTTP_200_OK, response_model=schema.AccountDeletionStatus)
+async def delete_account_status(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    progress = await account_deletion.progress(db, current_user.id.lower())
+    if progress is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No account deletion requested")
+    return progress
 
 @router.patch('/logout', status_code=status.HTTP_202_ACCEPTED)
 async def logout(data : schema.Logout, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
@@ -297,6 +350,7 @@ async def logout(data : schema.Logout, current_user: User = Depends(get_current_
         current_user.fcm_tokens = [t for t in (current_user.fcm_tokens) if t != token]
         print("After removal:", current_user.fcm_tokens)
         await db.commit()
+        user_cache.invalidate(current_user.id)
         return {"token": "removed"}
     if not data.fcm_token or data.fcm_token.strip() == "":
         return {"token": "not necessary"}
@@ -313,7 +367,8 @@ async def update_fcm_token(data: schema.UpdateFCMToken, current_user: User = Dep
     if data.previous_token not in (current_user.fcm_tokens or []):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Previous token not found")
     current_user.fcm_tokens = [t if t != data.previous_token else data.new_token for t in (current_user.fcm_tokens or [])]
-    db.commit()
+    await db.commit()
+    user_cache.invalidate(current_user.id)
 
 
 
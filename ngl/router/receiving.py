@@ -1,44 +1,125 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from ..database import *
-from .. import schema, oAuthentication
+from .. import schema, oAuthentication, counters, inbox_stream
 from sqlalchemy import update, select, delete, func, desc
+import base64
+import hashlib
+import asyncio
+import json
+import os
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:  # optional; json gives the same bytes, only slower
+    orjson = None
 
 router = APIRouter(
     prefix="/recieving",
     tags=['Receiving']
 )
 
-@router.get('/inbox', response_model=schema.Inbox, status_code=status.HTTP_200_OK)
-async def get_messages_list(
-    current_user: schema.UserID = Depends(oAuthentication.get_current_user),
-    skip: int | None = None,
-    limit: int = 100,
-    last_seen_id: int | None = None,
-    db: AsyncSession = Depends(get_db)
-):
-    user = await db.get(User, current_user.id)
-    if user is None:
+# Inbox pages from Core row tuples rendered straight to JSON (render_inbox);
+# False goes back to ORM entities validated through schema.Inbox.
+INBOX_FAST_PATH = os.getenv("INBOX_FAST_PATH", "True") == "True"
+
+def encode_cursor(last_id: int) -> str:
+    """Opaque keyset position: clients pass it back verbatim as ?cursor=."""
+    return base64.urlsafe_b64encode(f"v1:{last_id}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        version, last_id = raw.split(":", 1)
+        if version != "v1":
+            raise ValueError(version)
+        return int(last_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Invalid cursor'
+        )
+
+async def inbox_counters(db: AsyncSession, user_id: str):
+    row = (await db.execute(
+        select(User.message_count, User.unread_count, User.inbox_version).where(User.id == user_id)
+    )).first()
+    if row is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Cannot find such user'
         )
+    return row
 
-    # Count total messages for the user
-    total_count = await db.scalar(
-        select(func.count(Message.id)).where(Message.user_id == current_user.id)
-    )
+def inbox_etag(inbox_version: int, request: Request) -> str:
+    """Changes whenever the inbox does (inbox_version) or the client asks for a different page/mode."""
+    params = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    return f'"{inbox_version}-{hashlib.blake2s(params.encode(), digest_size=6).hexdigest()}"'
 
-    # Count unread messages
-    unread_count = await db.scalar(
-        select(func.count(Message.id)).where(
-            Message.user_id == current_user.id,
-            Message.unread == True
-        )
-    )
+def etag_matches(etag: str, if_none_match: str | None) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip().removeprefix("W/") for c in if_none_match.split(",")]
+    return etag in candidates or "*" in candidates
 
-    # Base query
+def inbox_columns(summary: bool) -> tuple:
+    """
+    Plain columns for render_inbox, in MessageItem field order. Postgres hands
+    time back as naive UTC, which is exactly schema.api_time, so rows need no
+    per-field conversion in Python.
+    """
+    columns = (Message.id, func.timezone("UTC", Message.time).label("time"), Message.unread)
+    return columns if summary else columns + (Message.content,)
+
+def render_inbox(counts, rows, summary: bool, next_cursor: str | None) -> bytes:
+    """
+    Inbox / InboxSummary JSON from inbox_columns() rows, byte for byte what
+    FastAPI renders for the models, without building ORM entities or
+    validating them twice (once into the model, once as response_model).
+    """
+    if summary:
+        messages = [{"id": message_id, "time": time, "unread": unread} for message_id, time, unread in rows]
+    else:
+        messages = [{"id": message_id, "time": time, "unread": unread, "content": content} for message_id, time, unread, content in rows]
+    body = {
+        "message_count": counts.message_count,
+        "unread_count": counts.unread_count,
+        "messages": messages,
+        "next_cursor": next_cursor,
+    }
+    if orjson is not None:
+        return orjson.dumps(body)
+    return json.dumps(body, default=datetime.isoformat, ensure_ascii=False, separators=(",", ":")).encode()
+
+@router.get('/inbox', response_model=schema.Inbox | schema.InboxSummary, status_code=status.HTTP_200_OK)
+async def get_messages_list(
+    request: Request,
+    response: Response,
+    current_user: schema.UserID = Depends(oAuthentication.get_current_user),
+    skip: int | None = Query(None, deprecated=True, description="OFFSET paging; slows down on large inboxes, use cursor"),
+    limit: int = 100,
+    last_seen_id: int | None = None,
+    cursor: str | None = None,
+    summary: bool = False,
+    db: AsyncSession = Depends(get_read_db)
+):
+    counts = await inbox_counters(db, current_user.id)
+
+    # Conditional GET: an unchanged inbox costs one primary-key lookup
+    etag = inbox_etag(counts.inbox_version, request)
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(etag, request.headers.get("if-none-match")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
+    response.headers.update(cache_headers)
+
+    if INBOX_FAST_PATH:
+        columns = inbox_columns(summary)
+    else:
+        # Summary mode only reads the columns the list view needs
+        columns = (Message.id, Message.time, Message.unread) if summary else (Message,)
     query = (
-        select(Message)
+        select(*columns)
         .where(Message.user_id == current_user.id)
         .order_by(desc(Message.id))
     )
@@ -46,22 +127,77 @@ async def get_messages_list(
     if limit > 0:
         query = query.limit(limit)
 
-    if skip is not None:  
-        # Use OFFSET-based pagination
-        query = query.offset(skip)
-    elif last_seen_id is not None:  
-        # Use keyset-based pagination
+    if cursor is not None:
+        last_seen_id = decode_cursor(cursor)
+
+    if last_seen_id is not None:
+        # Keyset pagination: an index seek on (user_id, id DESC), same cost on every page
         query = query.where(Message.id < last_seen_id)
+    elif skip is not None:
+        # Legacy OFFSET pagination
+        query = query.offset(skip)
 
     result = await db.execute(query)
-    messages = result.scalars().all()
+    if INBOX_FAST_PATH:
+        rows = result.all()
+        next_cursor = encode_cursor(rows[-1].id) if limit > 0 and len(rows) == limit else None
+        return Response(render_inbox(counts, rows, summary, next_cursor), media_type="application/json", headers=cache_headers)
 
-    return schema.Inbox(
-        message_count=total_count,
-        unread_count=unread_count,
-        messages=messages
+    messages = result.all() if summary else result.scalars().all()
+    next_cursor = encode_cursor(messages[-1].id) if limit > 0 and len(messages) == limit else None
+
+    return (schema.InboxSummary if summary else schema.Inbox)(
+        message_count=counts.message_count,
+        unread_count=counts.unread_count,
+        messages=messages,
+        next_cursor=next_cursor
     )
 
+STREAM_HEARTBEAT_SECONDS = 15
+
+@router.get('/stream', status_code=status.HTTP_200_OK)
+async def stream_inbox(current_user: schema.UserID = Depends(oAuthentication.get_stream_user)):
+    """
+    Server-Sent Events: one `message` event (MessageItem JSON) per new message.
+    Holds no DB connection. If the client falls too far behind it gets a
+    `resync` event and the stream ends; it should refetch /inbox and reconnect.
+    """
+    try:
+        sub = inbox_stream.subscribe(current_user.id)
+    except inbox_stream.TooManyStreams:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail='Too many open streams'
+        )
+
+    async def events():
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.next(), timeout=STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if event is None:
+                    yield "event: resync\ndata: {}\n\n"
+                    return
+                yield f"event: message\ndata: {json.dumps(event)}\n\n"
+        finally:
+            inbox_stream.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get('/unread_count', response_model=schema.UnreadCount, status_code=status.HTTP_200_OK)
+async def get_unread_count(current_user: schema.UserID = Depends(oAuthentication.get_current_user), db: AsyncSession = Depends(get_read_db)):
+    # Badge polling: one primary-key lookup, no message rows touched
+    row = await inbox_counters(db, current_user.id)
+    return schema.UnreadCount(message_count=row.message_count, unread_count=row.unread_count)
+
 
 
 # @router.get('/get_message/{id}', response_model=schema.Message)
@@ -93,33 +229,113 @@ async def get_messages_list(
 #     return row  ## TODO: revise
 
 @router.delete('/delete_message/{id}', status_code=status.HTTP_202_ACCEPTED)
-async def delete_message(id: int, db: AsyncSession = Depends(get_db), current_user: schema.UserID = Depends(oAuthentication.get_current_user)):
+async def delete_message(id: int, response: Response, db: AsyncSession = Depends(get_db), current_user: schema.UserID = Depends(oAuthentication.get_current_user)):
     stmt = (
         delete(Message)
         .where(Message.id == id, Message.user_id == current_user.id)
+        .returning(Message.unread)
     )
-    await db.execute(stmt)
+    was_unread = (await db.execute(stmt)).scalar_one_or_none()
+    if was_unread is not None:
+        await counters.bump(db, current_user.id, messages=-1, unread=-1 if was_unread else 0)
     await db.commit()
+    note_write(response)
     return
 
 @router.patch('/mark_unread/{id}', status_code=status.HTTP_202_ACCEPTED)
-async def mark_as_unread(id: int, db: AsyncSession = Depends(get_db), current_user: schema.UserID = Depends(oAuthentication.get_current_user)):
+async def mark_as_unread(id: int, response: Response, db: AsyncSession = Depends(get_db), current_user: schema.UserID = Depends(oAuthentication.get_current_user)):
     stmt = (
         update(Message)
         .where(Message.id == id, Message.user_id == current_user.id)
+        .where(Message.unread.is_not(True))
         .values(unread=True)
     )
-    await db.execute(stmt)
+    result = await db.execute(stmt)
+    await counters.bump(db, current_user.id, unread=result.rowcount)
     await db.commit()
+    note_write(response)
     return
 
+MAX_BULK_IDS = 1000
+
+def selection_filter(selection: schema.MessageSelection, user_id: str):
+    """WHERE clause for a bulk operation, always scoped to the current user."""
+    clauses = [Message.user_id == user_id]
+    has_range = selection.from_id is not None or selection.to_id is not None
+    chosen = sum([selection.ids is not None, has_range, selection.last_seen_id is not None])
+    if chosen != 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Give exactly one of ids, from_id/to_id or last_seen_id'
+        )
+
+    if selection.ids is not None:
+        if len(selection.ids) > MAX_BULK_IDS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f'At most {MAX_BULK_IDS} ids per request'
+            )
+        clauses.append(Message.id.in_(selection.ids))
+    elif has_range:
+        if selection.from_id is not None:
+            clauses.append(Message.id >= selection.from_id)
+        if selection.to_id is not None:
+            clauses.append(Message.id <= selection.to_id)
+    else:
+        clauses.append(Message.id <= selection.last_seen_id)
+    return clauses
+
+@router.patch('/bulk/mark_read', response_model=schema.BulkResult, status_code=status.HTTP_202_ACCEPTED)
+async def bulk_mark_as_read(selection: schema.MessageSelection, response: Response, db: AsyncSession = Depends(get_db), current_user: schema.UserID = Depends(oAuthentication.get_current_user)):
+    stmt = (
+        update(Message)
+        .where(*selection_filter(selection, current_user.id))
+        .where(Message.unread.is_(True))
+        .values(unread=False)
+    )
+    result = await db.execute(stmt)
+    await counters.bump(db, current_user.id, unread=-result.rowcount)
+    await db.commit()
+    note_write(response)
+    return schema.BulkResult(affected=result.rowcount)
+
+@router.patch('/bulk/mark_unread', response_model=schema.BulkResult, status_code=status.HTTP_202_ACCEPTED)
+async def bulk_mark_as_unread(selection: schema.MessageSelection, response: Response, db: AsyncSession = Depends(get_db), current_user: schema.UserID = Depends(oAuthentication.get_current_user)):
+    stmt = (
+        update(Message)
+        .where(*selection_filter(selection, current_user.id))
+        .where(Message.unread.is_not(True))
+        .values(unread=True)
+    )
+    result = await db.execute(stmt)
+    await counters.bump(db, current_user.id, unread=result.rowcount)
+    await db.commit()
+    note_write(response)
+    return schema.BulkResult(affected=result.rowcount)
+
+@router.delete('/bulk/delete', response_model=schema.BulkResult, status_code=status.HTTP_202_ACCEPTED)
+async def bulk_delete_messages(selection: schema.MessageSelection, response: Response, db: AsyncSession = Depends(get_db), current_user: schema.UserID = Depends(oAuthentication.get_current_user)):
+    stmt = (
+        delete(Message)
+        .where(*selection_filter(selection, current_user.id))
+        .returning(Message.unread)
+    )
+    was_unread = (await db.execute(stmt)).scalars().all()
+    await counters.bump(db, current_user.id, messages=-len(was_unread), unread=-sum(1 for u in was_unread if u))
+    await db.commit()
+    note_write(response)
+    return schema.BulkResult(affected=len(was_unread))
+
 @router.patch('/mark_read/{id}', status_code=status.HTTP_202_ACCEPTED)
-async def mark_as_read(id: int, db: AsyncSession = Depends(get_db), current_user: schema.UserID = Depends(oAuthentication.get_current_user)):
+async def mark_as_read(id: int, response: Response, db: AsyncSession = Depends(get_db), current_user: schema.UserID = Depends(oAuthentication.get_current_user)):
     stmt = (
         update(Message)
         .where(Message.id == id, Message.user_id == current_user.id)
+        .where(Message.unread.is_(True))
         .values(unread=False)
     )
-    await db.execute(stmt)
+    result = await db.execute(stmt)
+    await counters.bump(db, current_user.id, unread=-result.rowcount)
     await db.commit()
+    note_write(response)
     return
\ No newline at end of file
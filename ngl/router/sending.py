@@ -1,12 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from ..database import *
-from datetime import datetime
-from .. import schema
+from datetime import datetime, timezone
+from .. import schema, notifications, insert_batcher, user_cache, counters, inbox_stream, rate_limit, admission
 from fastapi.responses import FileResponse
-import requests
-import firebase_admin as fbad
 import asyncio
-from firebase_admin import messaging
 from ..timer import *
 from time import sleep
 
@@ -20,8 +17,8 @@ router = APIRouter(
 #     return FileResponse("pages/send.html")
 
 @router.get('/{user_id}', status_code=status.HTTP_302_FOUND, response_model=schema.ShowUserOnly)
-async def get_user(user_id: str, db: AsyncSession = Depends(get_db)):
-    user = await db.get(User, user_id.lower())
+async def get_user(user_id: str, db: AsyncSession = Depends(get_read_db)):
+    user = await user_cache.get_user(db, user_id.lower())
     if user:
         return user
     else:
@@ -76,31 +73,66 @@ async def get_user(user_id: str, db: AsyncSession = Depends(get_db)):
 #     return
 
 
-@router.post('/{user_id}', status_code=status.HTTP_202_ACCEPTED)
+def publish_new_message(user_id: str, msg_id: int, current_time: datetime, content: str):
+    inbox_stream.publish(user_id, {
+        "id": msg_id,
+        "time": schema.api_time(current_time),
+        "unread": True,
+        "content": content,
+    })
+
+
+@router.post('/{user_id}', status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(rate_limit.limit_send)])
 async def add_message(user_id: str, message: str, request: Request, db: AsyncSession = Depends(get_db)):
     t = CheckTimer("add_message")
 
-    # Getting ip address
-    x_forwarded_for = request.headers.get("X-Forwarded-For")
-    if x_forwarded_for:
-        client_ip = x_forwarded_for.split(",")[0]  # first IP is real client
-    else:
-        client_ip = request.client.host
+    # Getting ip address (already rate limited by rate_limit.limit_send)
+    client_ip = rate_limit.client_ip(request)
     t.cp("resolved client_ip")
 
     user_id = user_id.lower()
     t.cp("normalized user_id")
 
-    user = await db.get(User, user_id)
-    t.cp("db.get(User)")
+    # PostgreSQL text can't hold NUL; refuse it here rather than fail the insert
+    if "\x00" in message:
+        t.finish("rejected NUL")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Message contains invalid characters')
+
+    user = await user_cache.get_user(db, user_id)
+    t.cp("user_cache.get_user")
 
     if user is None:
-        t.cp("user not found")
+        t.finish("user not found")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User does not exist')
 
-    current_time = datetime.now().isoformat()
+    current_time = datetime.now(timezone.utc)
+    # A recipient with an open /recieving/stream on this worker gets the
+    # message pushed directly, so the FCM round trip can be skipped.
+    streamed = inbox_stream.STREAM_SKIPS_FCM and inbox_stream.has_subscribers(user_id)
+    # FCM delivery happens in the background dispatcher; the outbox row
+    # commits atomically with the message so nothing is lost if we crash.
+    # The dispatcher looks the tokens up at send time and drops rows with
+    # none, so the (possibly stale) cached tokens don't decide this.
+    notification = {
+        "id": str(user_id),
+        "time": schema.api_time(current_time),
+        "content": message,
+    } if not streamed else None
+
+    if insert_batcher.ENABLED:
+        # Hand the pooled connection back before waiting on the shared batch.
+        await db.close()
+        admission.release_early(request)
+        t.cp("released db connection")
+        msg_id = await insert_batcher.submit(user_id, message, current_time, notification)
+        t.finish("batched insert committed")
+        publish_new_message(user_id, msg_id, current_time, message)
+        notifications.wake_dispatcher()
+        return
+
     msg = Message(user_id=user_id, content=message, time=current_time)
     db.add(msg)
+    await counters.bump(db, user_id, messages=1, unread=1)
     t.cp("db.add(message)")
 
     # sleep(1)
@@ -109,34 +141,15 @@ async def add_message(user_id: str, message: str, request: Request, db: AsyncSes
     # await asyncio.sleep(1)
     # t.cp("simulated async delay")
 
-    # await db.commit()
-    # t.cp("db.commit() after insert")
-
-    # await db.refresh(msg)
-    # t.cp("db.refresh(message)")
-
-    if user.fcm_tokens:
-        multicast = messaging.MulticastMessage(
-            data={
-                "id": str(user_id),
-                "time": str(current_time),
-                "content": message,
-            },
-            notification=messaging.Notification(title="New Message"),
-            tokens=user.fcm_tokens
-        )
-        t.cp("prepared FCM multicast")
-        # async send
-        response = await messaging.send_each_for_multicast_async(multicast)
-        t.cp("FCM Response Time")
-
-        if response.failure_count > 0:
-            user.fcm_tokens = [token for resp, token in zip(response.responses, user.fcm_tokens) if resp.success]
-            t.cp("filtered bad FCM tokens")
+    if notification:
+        db.add(notifications.outbox_entry(user_id, notification))
+        t.cp("queued FCM notification")
     else:
-        t.cp("no FCM tokens")
+        t.cp("streamed, no FCM notification")
 
     await db.commit()
-    t.cp("final db.commit()")
+    t.finish("final db.commit()")
 
+    publish_new_message(user_id, msg.id, current_time, message)
+    notifications.wake_dispatcher()
     return 
\ No newline at end of file
@@ -2,6 +2,7 @@
 """
 Entry point for the FastAPI application.
 Run this script to start the server.
+Development only (single process, auto-reload); production uses python -m ngl.serve
 """
 
 if __name__ == "__main__":
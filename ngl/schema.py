@@ -1,5 +1,21 @@
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, BeforeValidator
+from typing import List, Annotated, Literal
+from datetime import datetime, timezone
+
+
+def api_time(value):
+    """
+    Render a message timestamp the way the API always has: naive ISO-8601 in
+    UTC (what datetime.now().isoformat() produced on the server), even though
+    the column is now timestamptz.
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.isoformat()
+    return value
+
+ApiTime = Annotated[str, BeforeValidator(api_time)]
 
 
 class CommunicationMessage(BaseModel):
@@ -15,7 +31,7 @@ class ShowUserOnly(BaseModel):
 
 class MessageInboxItem(BaseModel):
     id : int
-    time : str
+    time : ApiTime
     unread : bool
 
     class Config:
@@ -23,17 +39,41 @@ class MessageInboxItem(BaseModel):
 
 class MessageItem(BaseModel):
     id : int
-    time : str
+    time : ApiTime
     unread : bool
     content : str
 
     class Config:
         from_attributes = True
 
+class MessageSelection(BaseModel):
+    # Exactly one selector: explicit ids, an inclusive id range, or everything up to last_seen_id
+    ids : List[int] | None = None
+    from_id : int | None = None
+    to_id : int | None = None
+    last_seen_id : int | None = None
+
+class BulkResult(BaseModel):
+    affected : int
+
+class UnreadCount(BaseModel):
+    message_count : int
+    unread_count : int
+
 class Inbox(BaseModel):
     message_count : int
     unread_count : int
     messages: List[MessageItem]
+    next_cursor : str | None = None
+
+    class Config:
+        from_attributes = True
+
+class InboxSummary(BaseModel):
+    message_count : int
+    unread_count : int
+    messages: List[MessageInboxItem]
+    next_cursor : str | None = None
 
     class Config:
         from_attributes = True
@@ -78,4 +118,21 @@ class Logout(BaseModel):
 
 class UpdateFCMToken(BaseModel):
     previous_token: str
-    new_token: str
\ No newline at end of file
+    new_token: str
+
+class AccountDeletionStatus(BaseModel):
+    user_id : str
+    state : Literal["deleting", "completed"]
+    requested_at : ApiTime
+    messages_total : int
+    messages_deleted : int
+    completed_at : ApiTime | None = None
+
+class DiagnosticsUpdate(BaseModel):
+    level: Literal["off", "light", "full"]
+    asyncio_debug: bool | None = None
+    slow_callback_ms: float | None = None
+    watchdog_period_ms: int | None = None
+    watchdog_warn_ms: int | None = None
+    timer_sample_rate: float | None = None
+    timer_log_mode: Literal["each", "slow", "off"] | None = None
\ No newline at end of file
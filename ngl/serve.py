@@ -0,0 +1,252 @@
+# serve.py
+"""
+Production entry point (run.py is the reloading dev server):
+
+    python -m ngl.serve
+
+The app is imported once in this supervisor process (preload: import errors
+surface before any worker starts, and workers share the loaded pages), then
+WEB_CONCURRENCY worker processes are forked onto one listening socket.
+Workers default to the container's CPU quota. Each gets
+DB_CONNECTION_BUDGET // workers pool connections, so scaling workers never
+multiplies the load on Postgres. Likewise the SEND_* rate limits stay
+service-wide: each worker keeps its own buckets and enforces 1/workers of
+every rate and burst (RATE_LIMIT_WORKERS), so a client is held to roughly
+the configured limit however its requests are spread.
+
+Signals to the supervisor:
+    SIGTERM / SIGINT  drain: workers stop accepting, finish in-flight requests
+                      (up to GRACEFUL_TIMEOUT seconds), run lifespan shutdown
+    SIGHUP            rolling restart of the workers, one at a time
+    SIGUSR1           forwarded to every worker: re-read the diagnostics
+                      profile (sent by PUT /admin/diagnostics on any worker)
+A worker that dies unexpectedly is replaced.
+"""
+import logging
+import math
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+
+logger = logging.getLogger("serve")
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+# Total connections this service may hold on each database, across all workers
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "80"))
+READ_DB_CONNECTION_BUDGET = int(os.getenv("READ_DB_CONNECTION_BUDGET", str(DB_CONNECTION_BUDGET)))
+
+
+def _read(path: str) -> str | None:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit() -> int | None:
+    """CPUs allowed by the cgroup quota (v2 cpu.max, then v1 cfs), rounded up; None if unlimited."""
+    cpu_max = _read("/sys/fs/cgroup/cpu.max")
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            return max(1, math.ceil(int(quota) / int(period)))
+        return None
+    quota, period = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us"), _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        return max(1, math.ceil(int(quota) / int(period)))
+    return None
+
+
+def default_workers() -> int:
+    try:
+        available = len(os.sched_getaffinity(0))
+    except AttributeError:
+        available = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    return min(available, limit) if limit else available
+
+
+def budget_pools(workers: int):
+    """Split the connection budgets and rate limits across workers; explicit per-worker settings win."""
+    os.environ.setdefault("RATE_LIMIT_WORKERS", str(workers))
+    pool_size = max(2, DB_CONNECTION_BUDGET // workers)
+    os.environ.setdefault("DB_POOL_SIZE", str(pool_size))
+    pool_size = int(os.environ["DB_POOL_SIZE"])
+    # Keep a quarter (at most 8) for the outbox dispatcher and insert batcher
+    os.environ.setdefault("DB_ADMISSION_RESERVED", str(min(8, pool_size // 4)))
+    if os.getenv("DATABASE_READ_HOST"):
+        os.environ.setdefault("READ_DB_POOL_SIZE", str(max(2, READ_DB_CONNECTION_BUDGET // workers)))
+    if pool_size * workers > DB_CONNECTION_BUDGET:
+        logger.warning(f"[supervisor] {workers} workers x DB_POOL_SIZE={pool_size} exceeds DB_CONNECTION_BUDGET={DB_CONNECTION_BUDGET}")
+
+
+class Supervisor:
+    def __init__(self, config, sock, workers: int):
+        self.config = config
+        self.sock = sock
+        self.workers = workers
+        self.children: set[int] = set()
+        self.retiring: set[int] = set()
+        self.stopping = False
+        self.restart_requested = False
+        self.broadcast_requested = False
+        self._recent_crashes: list[float] = []
+
+    def spawn(self) -> int:
+        pid = os.fork()
+        if pid == 0:
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(sig, signal.SIG_DFL)
+            # Until the lifespan installs its handler (diagnostics.start), which then reads the profile anyway
+            signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+            import uvicorn
+            code = 0
+            try:
+                uvicorn.Server(self.config).run(sockets=[self.sock])
+            except BaseException:
+                logger.exception("[supervisor] worker crashed")
+                code = 1
+            finally:
+                os._exit(code)
+        self.children.add(pid)
+        logger.info(f"[supervisor] worker {pid} started")
+        return pid
+
+    def _on_stop(self, sig, frame):
+        self.stopping = True
+
+    def _on_hup(self, sig, frame):
+        self.restart_requested = True
+
+    def _on_usr1(self, sig, frame):
+        self.broadcast_requested = True
+
+    def reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            self.children.discard(pid)
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+            if not self.stopping:
+                logger.warning(f"[supervisor] worker {pid} exited unexpectedly (status {status}), replacing it")
+                now = time.monotonic()
+                self._recent_crashes = [t for t in self._recent_crashes if now - t < 10] + [now]
+                if len(self._recent_crashes) > 2 * self.workers:
+                    logger.error("[supervisor] workers keep crashing, giving up")
+                    self.stopping = True
+                    return
+                self.spawn()
+
+    def rolling_restart(self):
+        self.restart_requested = False
+        for old in list(self.children):
+            if self.stopping:
+                return
+            self.spawn()
+            time.sleep(1.0)  # let the replacement start its lifespan before the old one drains
+            self.retiring.add(old)
+            self._signal(old, signal.SIGTERM)
+        logger.info("[supervisor] rolling restart done")
+
+    def _signal(self, pid: int, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_hup)
+        signal.signal(signal.SIGUSR1, self._on_usr1)
+        for _ in range(self.workers):
+            self.spawn()
+
+        while not self.stopping:
+            if self.broadcast_requested:
+                self.broadcast_requested = False
+                for pid in self.children - self.retiring:
+                    self._signal(pid, signal.SIGUSR1)
+            if self.restart_requested:
+                self.rolling_restart()
+            self.reap()
+            time.sleep(0.2)
+
+        logger.info(f"[supervisor] draining {len(self.children)} workers")
+        for pid in self.children:
+            self._signal(pid, signal.SIGTERM)
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in self.children:
+            logger.warning(f"[supervisor] worker {pid} did not drain in time, killing it")
+            self._signal(pid, signal.SIGKILL)
+        self.sock.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format=" [%(name)s] %(message)s \n")
+    workers = int(os.getenv("WEB_CONCURRENCY", "0")) or default_workers()
+    budget_pools(workers)
+
+    import uvicorn
+    config = uvicorn.Config(
+        "ngl.main:app",
+        host=HOST,
+        port=PORT,
+        loop="auto",     # uvloop when installed
+        http="auto",     # httptools when installed
+        proxy_headers=True,
+        forwarded_allow_ips=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        lifespan="on",
+        access_log=os.getenv("ACCESS_LOG", "False") == "True",
+    )
+    logger.info(
+        f"[supervisor] {workers} workers, DB_POOL_SIZE={os.environ['DB_POOL_SIZE']} each, "
+        f"loop={'uvloop' if _installed('uvloop') else 'asyncio'}, http={'httptools' if _installed('httptools') else 'h11'}"
+    )
+
+    if not hasattr(os, "fork"):
+        # No fork (Windows): uvicorn's own supervisor, which imports the app in each worker
+        uvicorn.run(config.app, host=HOST, port=PORT, workers=workers, loop="auto", http="auto",
+                    timeout_graceful_shutdown=GRACEFUL_TIMEOUT)
+        return
+
+    # Read by diagnostics.py at import, so set before the preload
+    shared_dir = tempfile.mkdtemp(prefix="ngl-serve-")
+    os.environ["DIAGNOSTICS_SHARED_FILE"] = os.path.join(shared_dir, "diagnostics.json")
+    os.environ["NGL_SUPERVISOR_PID"] = str(os.getpid())
+    try:
+        config.load()  # preload the app before forking
+        sock = config.bind_socket()
+        Supervisor(config, sock, workers).run()
+    finally:
+        shutil.rmtree(shared_dir, ignore_errors=True)
+    sys.exit(0)
+
+
+def _installed(module: str) -> bool:
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+if __name__ == "__main__":
+    main()
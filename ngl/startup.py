@@ -0,0 +1,90 @@
+# startup.py
+"""
+Cold-start timeline, from process start to ready-to-serve.
+
+main.py calls mark() after each group of imports and once the app is built,
+the lifespan wraps each init step in step(), and work deferred past startup
+(Firebase) is recorded with deferred() when it finally runs. The report is
+logged once at ready() and served at GET /admin/startup-stats.
+
+For a per-module breakdown of the import phase:
+    python -X importtime -c "import ngl.main" 2>&1 | sort -t'|' -k2 -n | tail -30
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("checkpoint")
+
+_imported = time.perf_counter()
+_last = _imported
+_steps: list[tuple[str, float]] = []
+_deferred: list[tuple[str, float]] = []
+_ready_ms: float | None = None
+
+
+def _process_age_ms() -> float | None:
+    """How long this process had been running (interpreter start, site imports); Linux only."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, (uptime - start_ticks / os.sysconf("SC_CLK_TCK")) * 1000)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+_before_import_ms = _process_age_ms()
+
+
+def mark(name: str):
+    """Record the time since the previous mark/step (or since this module loaded) as name."""
+    global _last
+    now = time.perf_counter()
+    _steps.append((name, (now - _last) * 1000))
+    _last = now
+
+
+@contextmanager
+def step(name: str):
+    global _last
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _last = time.perf_counter()
+        _steps.append((name, (_last - started) * 1000))
+
+
+def deferred(name: str, ms: float):
+    """Init work that runs after ready(), off the path to the first request."""
+    _deferred.append((name, ms))
+
+
+def ready():
+    global _ready_ms
+    if _ready_ms is not None:
+        return
+    _ready_ms = (time.perf_counter() - _imported) * 1000
+    steps = ", ".join(f"{name} {ms:.0f}ms" for name, ms in _steps)
+    before = f"process start +{_before_import_ms:.0f}ms, " if _before_import_ms is not None else ""
+    logger.info(f"[startup] ready in {before}{_ready_ms:.0f}ms: {steps}")
+
+
+def report() -> dict:
+    return {
+        "before_import_ms": None if _before_import_ms is None else round(_before_import_ms, 1),
+        "ready_ms": None if _ready_ms is None else round(_ready_ms, 1),
+        "steps_ms": {name: round(ms, 1) for name, ms in _steps},
+        "deferred_ms": {name: round(ms, 1) for name, ms in _deferred},
+    }
+
+
+def stats() -> dict:
+    return {
+        "before_import_ms": _before_import_ms,
+        "ready_ms": _ready_ms,
+        "deferred_ms": sum(ms for _, ms in _deferred),
+    }
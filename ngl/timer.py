@@ -1,35 +1,118 @@
 # timers.py
+import os
 import time
+import random
 import logging
+from collections import deque
 from .loop_watchdog import get_loop_lag_snapshot
+from . import metrics
 
 logger = logging.getLogger("checkpoint")
 _has_thread_time = hasattr(time, "thread_time_ns")
 
+# Fraction of timers that record anything at all; the rest are no-ops.
+SAMPLE_RATE = float(os.getenv("CHECKTIMER_SAMPLE_RATE", "1.0"))
+# "each": log every checkpoint as it happens (old behaviour)
+# "slow": keep checkpoints in memory, log + keep the trace only if it was slow
+# "off":  metrics only
+LOG_MODE = os.getenv("CHECKTIMER_LOG_MODE", "slow")
+SLOW_MS = float(os.getenv("CHECKTIMER_SLOW_MS", "500"))
+RING_SIZE = int(os.getenv("CHECKTIMER_RING_SIZE", "100"))
+
+_slow_traces: deque = deque(maxlen=RING_SIZE)
+
+
+def configure(sample_rate: float | None = None, log_mode: str | None = None, slow_ms: float | None = None):
+    """Change sampling/logging at runtime; applies to timers created afterwards."""
+    global SAMPLE_RATE, LOG_MODE, SLOW_MS
+    if sample_rate is not None:
+        SAMPLE_RATE = sample_rate
+    if log_mode is not None:
+        if log_mode not in ("each", "slow", "off"):
+            raise ValueError(f"unknown log mode {log_mode!r}")
+        LOG_MODE = log_mode
+    if slow_ms is not None:
+        SLOW_MS = slow_ms
+
+
+def recent_slow_traces() -> list[dict]:
+    """Most recent first."""
+    return list(reversed(_slow_traces))
+
+
 class CheckTimer:
     """
     Drop-in checkpoint timer.
-    Use: t = CheckTimer("add_message"); t.cp("after db.get"); ...
-    Emits wall time, CPU time (process & thread), off-CPU estimate, and loop lag.
+    Use: t = CheckTimer("add_message"); t.cp("after db.get"); ...; t.finish("done")
+    Emits wall time, CPU time (process & thread), off-CPU estimate, and loop lag,
+    and records each segment in the metrics histograms under (name, label).
+    Only SAMPLE_RATE of timers are live; cp() on the others returns immediately.
     """
 
     def __init__(self, name: str):
         self.name = name
+        self.sampled = SAMPLE_RATE >= 1.0 or random.random() < SAMPLE_RATE
+        if not self.sampled:
+            return
+        self._log_mode = LOG_MODE
+        self._segments = [] if self._log_mode == "slow" else None
         self._start_wall = time.perf_counter_ns()
         self._start_cpu_proc = time.process_time_ns()
         self._start_cpu_thread = time.thread_time_ns() if _has_thread_time else None
         self._last_wall = self._start_wall
         self._last_cpu_proc = self._start_cpu_proc
         self._last_cpu_thread = self._start_cpu_thread
-        logger.info(f"[{self.name}] start")
+        if self._log_mode == "each":
+            logger.info(f"[{self.name}] start")
 
     def cp(self, label: str):
+        if not self.sampled:
+            return
         now_wall = time.perf_counter_ns()
         now_cpu_proc = time.process_time_ns()
         now_cpu_thread = time.thread_time_ns() if _has_thread_time else None
 
         seg_wall_ns = now_wall - self._last_wall
         seg_cpu_proc_ns = now_cpu_proc - self._last_cpu_proc
+        lag_ms, _ = get_loop_lag_snapshot()
+        metrics.observe_checkpoint(self.name, label, seg_wall_ns / 1e9, seg_cpu_proc_ns / 1e9, lag_ms / 1000.0)
+
+        if self._segments is not None:
+            self._segments.append((label, seg_wall_ns, seg_cpu_proc_ns, lag_ms))
+        elif self._log_mode == "each":
+            self._log(label, now_wall, now_cpu_proc, now_cpu_thread, seg_wall_ns, seg_cpu_proc_ns, lag_ms)
+
+        self._last_wall = now_wall
+        self._last_cpu_proc = now_cpu_proc
+        self._last_cpu_thread = now_cpu_thread
+
+    def finish(self, label: str):
+        """Last checkpoint. In "slow" mode, keeps and logs the whole trace if it exceeded SLOW_MS."""
+        if not self.sampled:
+            return
+        self.cp(label)
+        if self._segments is None:
+            return
+        total_wall_ms = (self._last_wall - self._start_wall) / 1e6
+        if total_wall_ms < SLOW_MS:
+            return
+        trace = {
+            "name": self.name,
+            "at": time.time(),
+            "total_wall_ms": round(total_wall_ms, 3),
+            "total_cpu_proc_ms": round((self._last_cpu_proc - self._start_cpu_proc) / 1e6, 3),
+            "segments": [
+                {"label": l, "wall_ms": round(w / 1e6, 3), "cpu_proc_ms": round(c / 1e6, 3), "loop_lag_ms": round(g, 1)}
+                for l, w, c, g in self._segments
+            ],
+        }
+        _slow_traces.append(trace)
+        logger.warning(
+            f"[{self.name}] slow: total_wall={total_wall_ms:.3f}ms | "
+            + " | ".join(f"{s['label']}={s['wall_ms']:.3f}ms" for s in trace["segments"])
+        )
+
+    def _log(self, label, now_wall, now_cpu_proc, now_cpu_thread, seg_wall_ns, seg_cpu_proc_ns, lag_ms):
         seg_cpu_thread_ns = (now_cpu_thread - self._last_cpu_thread) if _has_thread_time else None
 
         total_wall_ms = (now_wall - self._start_wall) / 1e6
@@ -37,7 +120,6 @@ class CheckTimer:
         total_cpu_thread_ms = ((now_cpu_thread - self._start_cpu_thread) / 1e6) if _has_thread_time else None
 
         offcpu_ms = (seg_wall_ns - seg_cpu_proc_ns) / 1e6
-        lag_ms, _ = get_loop_lag_snapshot()
 
         parts = [
             f"[{self.name}] {label}",
@@ -53,7 +135,3 @@ class CheckTimer:
             parts.append(f"total_cpu_thread={total_cpu_thread_ms:.3f}ms")
 
         logger.info(" | ".join(parts))
-
-        self._last_wall = now_wall
-        self._last_cpu_proc = now_cpu_proc
-        self._last_cpu_thread = now_cpu_thread
@@ -0,0 +1,76 @@
+# user_cache.py
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import User
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+# "No such user" is kept only briefly: signup on another worker can't
+# invalidate it, and the signup page checks availability just before.
+USER_CACHE_MISS_TTL_SECONDS = float(os.getenv("USER_CACHE_MISS_TTL_SECONDS", "1"))
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    id: str
+    name: str | None
+
+
+# user_id -> (expires_at, CachedUser | None). None caches "no such user".
+_entries: "OrderedDict[str, tuple[float, CachedUser | None]]" = OrderedDict()
+_hits = 0
+_misses = 0
+_evictions = 0
+
+
+async def get_user(db: AsyncSession, user_id: str) -> CachedUser | None:
+    """
+    Cached replacement for db.get(User, user_id) on read-only paths.
+    Entries are per process, so other workers only see a change once
+    USER_CACHE_TTL_SECONDS (USER_CACHE_MISS_TTL_SECONDS for a miss) has
+    passed; call invalidate() after any write.
+    An account pending deletion reads as None, like one that is gone.
+    """
+    global _hits, _misses, _evictions
+    now = time.monotonic()
+    entry = _entries.get(user_id)
+    if entry is not None and entry[0] > now:
+        _entries.move_to_end(user_id)
+        _hits += 1
+        return entry[1]
+
+    _misses += 1
+    user = await db.get(User, user_id)
+    if user is not None and user.deleted_at is not None:
+        user = None
+    cached = CachedUser(id=user.id, name=user.name) if user else None
+    ttl = USER_CACHE_TTL_SECONDS if cached else USER_CACHE_MISS_TTL_SECONDS
+    _entries[user_id] = (now + ttl, cached)
+    _entries.move_to_end(user_id)
+    while len(_entries) > USER_CACHE_SIZE:
+        _entries.popitem(last=False)
+        _evictions += 1
+    return cached
+
+
+def invalidate(user_id: str):
+    _entries.pop(user_id, None)
+
+
+def stats() -> dict:
+    lookups = _hits + _misses
+    return {
+        "size": len(_entries),
+        "max_size": USER_CACHE_SIZE,
+        "ttl_seconds": USER_CACHE_TTL_SECONDS,
+        "miss_ttl_seconds": USER_CACHE_MISS_TTL_SECONDS,
+        "hits": _hits,
+        "misses": _misses,
+        "evictions": _evictions,
+        "hit_ratio": round(_hits / lookups, 4) if lookups else None,
+    }